@@ -10,38 +10,1227 @@ import sys
 import os
 import json
 import uuid
+import re
+import time
+import heapq
+import zlib
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+from urllib.parse import quote, urlencode
+
+DEFAULT_DB_PATH = "/Users/cloudv/Desktop/todo-sqlite/simple.db"
+
+
+class QueryProfiler:
+    """SQL语句性能分析器: 记录耗时、返回行数及慢查询执行计划"""
+
+    def __init__(self, slow_query_ms: float = 100.0, slow_query_log: Optional[str] = None):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.records: List[Dict[str, Any]] = []
+
+    def start(self, method: str, sql: str, params) -> Dict[str, Any]:
+        """登记一条语句, 返回可累加耗时和行数的记录"""
+        record = {
+            'method': method,
+            'sql': ' '.join(sql.split()),
+            'params': tuple(params) if params else (),
+            'elapsed_ms': 0.0,
+            'rows': 0,
+        }
+        self.records.append(record)
+        return record
+
+    @staticmethod
+    def explain(conn: sqlite3.Connection, sql: str, params) -> List[str]:
+        """获取语句的 EXPLAIN QUERY PLAN"""
+        try:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        except sqlite3.Error as e:
+            return [f'(无法获取执行计划: {e})']
+        return [row[3] for row in rows]
+
+    @staticmethod
+    def full_scans(sql: str, plan: List[str]) -> List[str]:
+        """找出执行计划中对 todo_unified (及紧凑/增量存储的实际表) 的全表扫描"""
+        names = {'todo_unified', 'todo_compact', 'todo_delta'}
+        names.update(re.findall(r'\btodo_unified\s+(?:AS\s+)?(\w+)', sql, re.IGNORECASE))
+        names -= {'WHERE', 'ORDER', 'GROUP', 'JOIN', 'ON', 'LIMIT', 'SET', 'VALUES'}
+        scans = []
+        for detail in plan:
+            match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+            if match and match.group(1) in names:
+                scans.append(detail)
+        return scans
+
+    def finish(self, connect) -> List[Dict[str, Any]]:
+        """为慢查询获取执行计划并写入慢查询日志, 返回慢查询列表"""
+        slow = [r for r in self.records if r['elapsed_ms'] >= self.slow_query_ms]
+        if not slow:
+            return slow
+
+        with connect() as conn:
+            for record in slow:
+                record['plan'] = self.explain(conn, record['sql'], record['params'])
+                record['full_scans'] = self.full_scans(record['sql'], record['plan'])
+
+        if self.slow_query_log:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            with open(self.slow_query_log, 'a', encoding='utf-8') as f:
+                for record in slow:
+                    f.write(f"[{timestamp}] {record['method']} {record['elapsed_ms']:.2f}ms rows={record['rows']}\n")
+                    f.write(f"  SQL: {record['sql']}\n")
+                    if record['params']:
+                        f.write(f"  参数: {record['params']!r}\n")
+                    for detail in record['plan']:
+                        f.write(f"  PLAN: {detail}\n")
+                    for detail in record['full_scans']:
+                        f.write(f"  ⚠️ 全表扫描 todo_unified: {detail}\n")
+        return slow
+
+    def report(self, connect, out=None):
+        """按方法输出每条语句的耗时分布 (默认写到 stdout)"""
+        out = out or sys.stdout
+        slow = self.finish(connect)
+        if not self.records:
+            return
+
+        by_method: Dict[str, List[Dict[str, Any]]] = {}
+        for record in self.records:
+            by_method.setdefault(record['method'], []).append(record)
+
+        print(f"\n⏱️ 查询性能分析:", file=out)
+        print(f"{'方法':<24} {'语句数':<8} {'耗时(ms)':<12} {'行数':<8}", file=out)
+        print("─" * 60, file=out)
+        for method, records in by_method.items():
+            total = sum(r['elapsed_ms'] for r in records)
+            rows = sum(r['rows'] for r in records)
+            print(f"{method:<24} {len(records):<8} {total:<12.2f} {rows:<8}", file=out)
+            for index, record in enumerate(records, 1):
+                share = record['elapsed_ms'] / total * 100 if total else 0.0
+                print(f"  #{index:<3} {record['elapsed_ms']:>9.2f}ms {share:>5.1f}% {record['rows']:>7} 行  {record['sql'][:60]}", file=out)
+
+        if slow:
+            print(f"\n🐢 慢查询 (≥ {self.slow_query_ms}ms): {len(slow)} 条", file=out)
+            for record in slow:
+                print(f"  {record['method']} {record['elapsed_ms']:.2f}ms: {record['sql'][:70]}", file=out)
+                for detail in record['full_scans']:
+                    print(f"    ⚠️ 全表扫描 todo_unified: {detail}", file=out)
+            if self.slow_query_log:
+                print(f"📁 慢查询日志: {self.slow_query_log}", file=out)
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """记录每条语句耗时和返回行数的游标"""
+
+    profiler: Optional[QueryProfiler] = None
+    method = ''
+    _record: Optional[Dict[str, Any]] = None
+
+    def execute(self, sql, parameters=()):
+        return self._timed_execute(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # 执行计划使用第一组参数获取
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else ()
+        return self._timed_execute(super().executemany, sql, seq_of_parameters, first)
+
+    def _timed_execute(self, execute, sql, parameters, explain_parameters):
+        self._record = self.profiler.start(self.method, sql, explain_parameters)
+        started = time.perf_counter()
+        try:
+            return execute(sql, parameters)
+        finally:
+            self._record['elapsed_ms'] += (time.perf_counter() - started) * 1000
+            if self.rowcount > 0:
+                self._record['rows'] += self.rowcount
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = fetch(*args)
+        if self._record is not None:
+            self._record['elapsed_ms'] += (time.perf_counter() - started) * 1000
+            if isinstance(result, list):
+                self._record['rows'] += len(result)
+            elif result is not None:
+                self._record['rows'] += 1
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def __next__(self):
+        return self._timed_fetch(super().__next__)
+
+
+class TodoConnection(sqlite3.Connection):
+    """TodoManager 使用的连接, 开启分析时返回 ProfilingCursor
+
+    开启分析时 conn.execute/executemany 也经 ProfilingCursor 执行 (CPython 的
+    Connection.execute 直接调用C实现的游标, 不会经过子类的 execute);
+    作为上下文管理器提交后, 把本次写入的行数交给 on_commit 回调
+    """
+
+    profiler: Optional[QueryProfiler] = None
+    method = ''
+    on_commit = None
+    _changes_counted = 0
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        result = super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.on_commit is not None:
+            changes = self.total_changes - self._changes_counted
+            self._changes_counted = self.total_changes
+            if changes:
+                self.on_commit(changes)
+        return result
+
+    def execute(self, sql, parameters=()):
+        if self.profiler is None:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.profiler is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def cursor(self, factory=None):
+        if self.profiler is None:
+            return super().cursor() if factory is None else super().cursor(factory)
+        cursor = super().cursor(ProfilingCursor)
+        cursor.profiler = self.profiler
+        cursor.method = self.method
+        return cursor
+
+
+class LatencyHistogram:
+    """固定桶边界的延迟直方图 (单位: 秒)"""
+
+    BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+              0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(self.BOUNDS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按桶内线性插值估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket in enumerate(self.buckets):
+            if bucket and cumulative + bucket >= rank:
+                if index == len(self.BOUNDS):
+                    return self.BOUNDS[-1]
+                lower = self.BOUNDS[index - 1] if index else 0.0
+                upper = self.BOUNDS[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket
+            cumulative += bucket
+        return self.BOUNDS[-1]
+
+
+class MetricsRegistry:
+    """命令延迟直方图和计数器, 可持久化到 todo_metrics 表并导出为 Prometheus 文本格式"""
+
+    COUNTERS = {
+        'transaction_retries': '因数据库锁定而重试的事务数',
+        'rows_written': '写入的行数',
+    }
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+
+    def observe(self, command: str, seconds: float):
+        histogram = self.latency.get(command)
+        if histogram is None:
+            histogram = self.latency[command] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def inc(self, name: str, command: str, amount: float = 1):
+        key = (name, command)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def save(self, conn: sqlite3.Connection):
+        """把内存中的增量累加进 todo_metrics 表并清空"""
+        rows = []
+        for command, histogram in self.latency.items():
+            for bound, bucket in zip(self.BOUNDS_LABELS, histogram.buckets):
+                if bucket:
+                    rows.append(('duration_bucket', command, bound, bucket))
+            rows.append(('duration_sum', command, '', histogram.sum))
+            rows.append(('duration_count', command, '', histogram.count))
+        for (name, command), value in self.counters.items():
+            rows.append((name, command, '', value))
+        if rows:
+            conn.executemany('''
+                INSERT INTO todo_metrics (metric, command, le, value) VALUES (?, ?, ?, ?)
+                ON CONFLICT (metric, command, le) DO UPDATE SET value = value + excluded.value
+            ''', rows)
+        self.latency = {}
+        self.counters = {}
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> 'MetricsRegistry':
+        """从 todo_metrics 表读取累计指标"""
+        registry = cls()
+        bucket_index = {label: index for index, label in enumerate(cls.BOUNDS_LABELS)}
+        for metric, command, le, value in conn.execute(
+                'SELECT metric, command, le, value FROM todo_metrics'):
+            if metric == 'duration_bucket':
+                registry.latency.setdefault(command, LatencyHistogram()).buckets[bucket_index[le]] += int(value)
+            elif metric == 'duration_sum':
+                registry.latency.setdefault(command, LatencyHistogram()).sum += value
+            elif metric == 'duration_count':
+                registry.latency.setdefault(command, LatencyHistogram()).count += int(value)
+            else:
+                registry.inc(metric, command, value)
+        return registry
+
+    def render_prometheus(self, gauges: Dict[str, int]) -> str:
+        """生成 Prometheus 文本格式"""
+        lines = [
+            '# HELP todo_command_duration_seconds 命令执行耗时',
+            '# TYPE todo_command_duration_seconds histogram',
+        ]
+        for command in sorted(self.latency):
+            histogram = self.latency[command]
+            cumulative = 0
+            for label, bucket in zip(self.BOUNDS_LABELS, histogram.buckets):
+                cumulative += bucket
+                lines.append(f'todo_command_duration_seconds_bucket{{command="{command}",le="{label}"}} {cumulative}')
+            lines.append(f'todo_command_duration_seconds_sum{{command="{command}"}} {histogram.sum:.6f}')
+            lines.append(f'todo_command_duration_seconds_count{{command="{command}"}} {histogram.count}')
+
+        lines.append('# HELP todo_command_duration_quantile_seconds 由直方图估算的命令耗时分位数')
+        lines.append('# TYPE todo_command_duration_quantile_seconds gauge')
+        for command in sorted(self.latency):
+            for q in self.QUANTILES:
+                value = self.latency[command].quantile(q)
+                lines.append(f'todo_command_duration_quantile_seconds{{command="{command}",quantile="{q}"}} {value:.6f}')
+
+        for name, help_text in self.COUNTERS.items():
+            lines.append(f'# HELP todo_{name}_total {help_text}')
+            lines.append(f'# TYPE todo_{name}_total counter')
+            for (counter, command), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f'todo_{name}_total{{command="{command}"}} {value:g}')
+
+        lines.append('# HELP todo_db_size_bytes 数据库文件大小')
+        lines.append('# TYPE todo_db_size_bytes gauge')
+        for file_kind, size in gauges.items():
+            lines.append(f'todo_db_size_bytes{{file="{file_kind}"}} {size}')
+        return '\n'.join(lines) + '\n'
+
+
+MetricsRegistry.BOUNDS_LABELS = tuple(f'{b:g}' for b in LatencyHistogram.BOUNDS) + ('+Inf',)
+
+
+STATUS_ORDER = {'in_progress': 1, 'todo': 2, 'completed': 3}
+
+# 紧凑存储中枚举字段保存为这些元组中的下标
+STATUS_VALUES = ('todo', 'in_progress', 'completed')
+PRIORITY_VALUES = ('low', 'medium', 'high')
+OPERATION_VALUES = ('create', 'update', 'status_change', 'delete', 'restore', 'current_snapshot', 'migration')
+
+
+def uuid_to_blob(value):
+    """标准小写UUID文本 -> 16字节; 其他值 (如自定义ID) 原样保存"""
+    if isinstance(value, str) and len(value) == 36:
+        try:
+            parsed = uuid.UUID(value)
+        except ValueError:
+            return value
+        if str(parsed) == value:
+            return parsed.bytes
+    return value
+
+
+def _decode_uuid_sql(column: str) -> str:
+    hex_value = f'lower(hex({column}))'
+    return (f"CASE WHEN typeof({column}) = 'blob' AND length({column}) = 16 THEN "
+            f"substr({hex_value}, 1, 8) || '-' || substr({hex_value}, 9, 4) || '-' || "
+            f"substr({hex_value}, 13, 4) || '-' || substr({hex_value}, 17, 4) || '-' || "
+            f"substr({hex_value}, 21) ELSE {column} END")
+
+
+def _decode_enum_sql(column: str, values: tuple) -> str:
+    whens = ' '.join(f"WHEN {code} THEN '{value}'" for code, value in enumerate(values))
+    return f"CASE {column} {whens} END"
+
+
+def _encode_enum_sql(expr: str, values: tuple, name: str) -> str:
+    whens = ' '.join(f"WHEN '{value}' THEN {code}" for code, value in enumerate(values))
+    return (f"CASE WHEN {expr} IS NULL THEN NULL ELSE CASE {expr} {whens} "
+            f"ELSE RAISE(ABORT, 'CHECK constraint failed: {name}') END END")
+
+
+def _compact_row_sql(prefix: str) -> str:
+    """把 todo_unified 视图中的一行 (NEW) 编码为 todo_compact 的各列"""
+    return f'''todo_uuid_blob({prefix}.task_uuid), {prefix}.version, {prefix}.task,
+            {_encode_enum_sql(f'{prefix}.status', STATUS_VALUES, 'status')},
+            {_encode_enum_sql(f'{prefix}.priority', PRIORITY_VALUES, 'priority')},
+            {prefix}.due_date,
+            {_encode_enum_sql(f'{prefix}.operation_type', OPERATION_VALUES, 'operation_type')},
+            {prefix}.change_summary'''
+
+
+# 紧凑存储: UUID 保存为16字节BLOB, 枚举保存为小整数;
+# todo_unified 变为解码视图, 写入经 INSTEAD OF 触发器编码, 因此所有查询保持不变;
+# 触发器使用 connect_database 注册的 todo_uuid_blob 函数, 未注册该函数的客户端只能读取
+COMPACT_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS todo_compact (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_uuid BLOB NOT NULL,
+        version INTEGER DEFAULT 1,
+        task TEXT NOT NULL,
+        status INTEGER CHECK(status BETWEEN 0 AND {len(STATUS_VALUES) - 1}),
+        priority INTEGER CHECK(priority BETWEEN 0 AND {len(PRIORITY_VALUES) - 1}),
+        due_date DATE,
+        operation_type INTEGER CHECK(operation_type BETWEEN 0 AND {len(OPERATION_VALUES) - 1}),
+        change_summary TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_task_uuid ON todo_compact(task_uuid)',
+    'CREATE INDEX IF NOT EXISTS idx_status ON todo_compact(status)',
+    f'''
+    CREATE VIEW IF NOT EXISTS todo_unified AS
+    SELECT
+        id,
+        {_decode_uuid_sql('task_uuid')} AS task_uuid,
+        version,
+        task,
+        {_decode_enum_sql('status', STATUS_VALUES)} AS status,
+        {_decode_enum_sql('priority', PRIORITY_VALUES)} AS priority,
+        due_date,
+        {_decode_enum_sql('operation_type', OPERATION_VALUES)} AS operation_type,
+        change_summary,
+        created_at,
+        updated_at
+    FROM todo_compact
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS todo_unified_insert INSTEAD OF INSERT ON todo_unified
+    BEGIN
+        INSERT INTO todo_compact (
+            id, task_uuid, version, task, status, priority, due_date, operation_type, change_summary,
+            created_at, updated_at
+        ) VALUES (
+            NEW.id, {_compact_row_sql('NEW')},
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP), COALESCE(NEW.updated_at, CURRENT_TIMESTAMP)
+        );
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS todo_unified_update INSTEAD OF UPDATE ON todo_unified
+    BEGIN
+        UPDATE todo_compact SET
+            (task_uuid, version, task, status, priority, due_date, operation_type, change_summary,
+             created_at, updated_at) = ({_compact_row_sql('NEW')}, NEW.created_at, NEW.updated_at)
+        WHERE id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS todo_unified_delete INSTEAD OF DELETE ON todo_unified
+    BEGIN
+        DELETE FROM todo_compact WHERE id = OLD.id;
+    END
+    ''',
+]
+
+# 每个新版本从上一版本继承的字段
+TASK_FIELDS = ('task', 'status', 'priority', 'due_date')
+
+# 增量存储中每隔多少个版本写入一次完整检查点
+DELTA_CHECKPOINT_INTERVAL = 16
+
+
+def _carried_value_sql(column: str, window: str = '') -> str:
+    """取版本号最大的非 NULL 值 (版本号补零后拼在值前面, 按字符串取 MAX)"""
+    return (f"substr(MAX(CASE WHEN {column} IS NOT NULL THEN printf('%010d', version) || {column} END)"
+            f"{window}, 11)")
+
+
+def _clears_field_sql(new: str, old: str) -> str:
+    """任一继承字段从有值变为 NULL 的条件 (增量行中 NULL 表示未变化, 无法表达清空)"""
+    return ' OR '.join(f"({new}.{field} IS NULL AND {old}{field} IS NOT NULL)" for field in TASK_FIELDS)
+
+
+# 增量存储: 每个版本只保存相对上一版本变化的字段, 每 DELTA_CHECKPOINT_INTERVAL 个版本
+# 保存一次完整行; base_version 指向所属检查点。todo_unified 变为窗口函数重建的视图,
+# 写入经 INSTEAD OF 触发器计算差异, 因此所有查询保持不变
+DELTA_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS todo_delta (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_uuid TEXT NOT NULL,
+        version INTEGER DEFAULT 1,
+        base_version INTEGER NOT NULL,
+        task TEXT,
+        status TEXT CHECK(status IN ('todo', 'in_progress', 'completed')),
+        priority TEXT CHECK(priority IN ('low', 'medium', 'high')),
+        due_date DATE,
+        operation_type TEXT CHECK(operation_type IN ('create', 'update', 'status_change', 'delete', 'restore', 'current_snapshot', 'migration')) DEFAULT 'update',
+        change_summary TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_task_uuid ON todo_delta(task_uuid, base_version, version)',
+    f'''
+    CREATE VIEW IF NOT EXISTS todo_unified AS
+    SELECT
+        id,
+        task_uuid,
+        version,
+        {_carried_value_sql('task', ' OVER history')} AS task,
+        {_carried_value_sql('status', ' OVER history')} AS status,
+        {_carried_value_sql('priority', ' OVER history')} AS priority,
+        {_carried_value_sql('due_date', ' OVER history')} AS due_date,
+        operation_type,
+        change_summary,
+        created_at,
+        updated_at
+    FROM todo_delta
+    WINDOW history AS (PARTITION BY task_uuid, base_version ORDER BY version)
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS todo_unified_insert INSTEAD OF INSERT ON todo_unified
+    BEGIN
+        SELECT RAISE(ABORT, 'NOT NULL constraint failed: todo_unified.task') WHERE NEW.task IS NULL;
+        INSERT INTO todo_delta (
+            id, task_uuid, version, base_version, task, status, priority, due_date,
+            operation_type, change_summary, created_at, updated_at
+        )
+        SELECT
+            NEW.id, NEW.task_uuid, NEW.version,
+            CASE WHEN checkpoint THEN NEW.version ELSE base_version END,
+            {', '.join(f'CASE WHEN checkpoint OR NEW.{field} IS NOT {field} THEN NEW.{field} END'
+                       for field in TASK_FIELDS)},
+            NEW.operation_type, NEW.change_summary,
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP), COALESCE(NEW.updated_at, CURRENT_TIMESTAMP)
+        FROM (
+            SELECT *, (
+                version IS NULL OR NEW.version <= version
+                OR NEW.version - base_version >= {DELTA_CHECKPOINT_INTERVAL}
+                OR {_clears_field_sql('NEW', '')}
+            ) AS checkpoint
+            FROM (
+                SELECT
+                    MAX(version) AS version,
+                    MAX(base_version) AS base_version,
+                    {', '.join(f'{_carried_value_sql(field)} AS {field}' for field in TASK_FIELDS)}
+                FROM todo_delta
+                WHERE task_uuid = NEW.task_uuid AND base_version = (
+                    SELECT base_version FROM todo_delta
+                    WHERE task_uuid = NEW.task_uuid
+                    ORDER BY version DESC LIMIT 1
+                )
+            )
+        );
+        -- 插入到已有版本之间 (如复制重放) 时新行是检查点, 之后的版本改为基于它重建
+        UPDATE todo_delta SET base_version = NEW.version
+        WHERE task_uuid = NEW.task_uuid AND version > NEW.version AND base_version <= NEW.version;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS todo_unified_update INSTEAD OF UPDATE ON todo_unified
+    BEGIN
+        SELECT RAISE(ABORT, 'NOT NULL constraint failed: todo_unified.task') WHERE NEW.task IS NULL;
+        SELECT RAISE(ABORT, 'delta version cannot clear an inherited field')
+        WHERE ({_clears_field_sql('NEW', 'OLD.')})
+        AND OLD.version != (SELECT base_version FROM todo_delta WHERE id = OLD.id);
+        UPDATE todo_delta SET
+            {', '.join(f'{field} = CASE WHEN NEW.{field} IS OLD.{field} THEN {field} ELSE NEW.{field} END'
+                       for field in TASK_FIELDS)},
+            operation_type = NEW.operation_type,
+            change_summary = NEW.change_summary,
+            created_at = NEW.created_at,
+            updated_at = NEW.updated_at
+        WHERE id = OLD.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS todo_unified_delete INSTEAD OF DELETE ON todo_unified
+    BEGIN
+        -- 下一个版本继承被删除版本的完整字段; 删除的是检查点时由它成为新的检查点
+        UPDATE todo_delta SET
+            {', '.join(f'{field} = COALESCE({field}, OLD.{field})' for field in TASK_FIELDS)}
+        WHERE id = (
+            SELECT id FROM todo_delta
+            WHERE task_uuid = OLD.task_uuid AND version > OLD.version
+            AND base_version = (SELECT base_version FROM todo_delta WHERE id = OLD.id)
+            ORDER BY version LIMIT 1
+        );
+        UPDATE todo_delta SET base_version = (
+            SELECT MIN(version) FROM todo_delta
+            WHERE task_uuid = OLD.task_uuid AND version > OLD.version
+        )
+        WHERE task_uuid = OLD.task_uuid AND base_version = OLD.version AND version > OLD.version;
+        DELETE FROM todo_delta WHERE id = OLD.id;
+    END
+    ''',
+]
+
+def _change_log_schema(table: str) -> List[str]:
+    """复制使用的修改日志: 存储表的行被原地修改或删除时, 记录所属任务和递增的序号
+
+    每个任务只保留最近一次修改的序号, 日志大小不超过任务数
+    """
+    statements = [
+        '''
+        CREATE TABLE IF NOT EXISTS todo_changes (
+            task_uuid TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_changes_seq ON todo_changes(seq)',
+    ]
+    for event, rows in (('UPDATE', ('OLD', 'NEW')), ('DELETE', ('OLD',))):
+        task_uuids = ' UNION '.join(
+            f"SELECT {_decode_uuid_sql(f'{row}.task_uuid') if table == 'todo_compact' else f'{row}.task_uuid'} AS task_uuid"
+            for row in rows)
+        statements.append(f'''
+        CREATE TRIGGER IF NOT EXISTS todo_changes_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            INSERT OR REPLACE INTO todo_changes (task_uuid, seq)
+            SELECT task_uuid, (SELECT COALESCE(MAX(seq), 0) + 1 FROM todo_changes)
+            FROM ({task_uuids});
+        END
+        ''')
+    return statements
+
+
+# 分片 i 的自增ID从 i << SHARD_ID_BITS 开始, 保证各分片的行ID全局唯一
+SHARD_ID_BITS = 40
+
+
+def shard_paths_for(db_path: str, shards: int) -> List[str]:
+    """分片数据库文件路径: simple.db -> simple.shard0.db, simple.shard1.db, ..."""
+    if shards <= 1:
+        return [db_path]
+    base, ext = os.path.splitext(db_path)
+    return [f"{base}.shard{i}{ext or '.db'}" for i in range(shards)]
+
+
+def shard_index(task_uuid: str, shards: int) -> int:
+    """按 task_uuid 哈希选择分片"""
+    return zlib.crc32(task_uuid.encode('utf-8')) % shards
+
+
+def sqlite_uri(db_path: str, **params) -> str:
+    """数据库文件的 SQLite URI (如 mode=ro 只读打开)"""
+    return f"file:{quote(os.path.abspath(db_path))}?{urlencode(params)}"
+
+
+# 快照模式下每个连接的内存映射上限
+SNAPSHOT_MMAP_SIZE = 1 << 30
+
+
+def connect_database(db_path: str, snapshot: bool = False, factory=sqlite3.Connection) -> sqlite3.Connection:
+    """打开数据库文件
+
+    snapshot=True 时以 immutable=1 只读方式打开备份文件: SQLite 不加锁、不检查
+    其他连接的修改, 并通过 mmap 直接读取页面。每个连接都注册紧凑存储写入和
+    按UUID查询所需的 todo_uuid_blob 函数
+    """
+    if not snapshot:
+        conn = sqlite3.connect(db_path, factory=factory)
+    elif not os.path.exists(db_path):
+        raise sqlite3.OperationalError(f"快照文件不存在: {db_path}")
+    else:
+        conn = sqlite3.connect(sqlite_uri(db_path, mode='ro', immutable=1), uri=True, factory=factory)
+        conn.execute(f'PRAGMA mmap_size = {SNAPSHOT_MMAP_SIZE}')
+    conn.create_function('todo_uuid_blob', 1, uuid_to_blob, deterministic=True)
+    return conn
+
+
+def _fetch_shard_rows(db_path: str, sql: str, params, snapshot: bool = False) -> Tuple[List[tuple], float]:
+    """在单个分片上执行只读查询 (供进程池调用), 返回 (结果行, 耗时毫秒)"""
+    conn = connect_database(db_path, snapshot)
+    try:
+        started = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        return rows, (time.perf_counter() - started) * 1000
+    finally:
+        conn.close()
+
+
+# fsck 按 task_uuid 首字节把每个分片划分为 64 个区间并行检查
+FSCK_RANGE_BOUNDS = list(range(4, 256, 4))
+
+
+def _fsck_range(db_path: str, check_sql: str, count_sql: str, params) -> Tuple[int, int, List[tuple]]:
+    """在只读连接上检查一个 task_uuid 区间, 返回 (行数, 任务数, 问题行)"""
+    conn = sqlite3.connect(sqlite_uri(db_path, mode='ro'), uri=True)
+    try:
+        rows, tasks = conn.execute(count_sql, params).fetchone()
+        return rows, tasks, conn.execute(check_sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+class Descending:
+    """排序键包装: 按降序比较, None 排在最后 (与 SQLite 的 DESC 一致)"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other: 'Descending') -> bool:
+        if self.value is None:
+            return False
+        if other.value is None:
+            return True
+        return other.value < self.value
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Descending) and self.value == other.value
+
+
+def task_list_order(row) -> tuple:
+    """list/filter 的排序: 状态 (进行中 > 待办 > 已完成), 创建时间倒序, 再按UUID"""
+    return (STATUS_ORDER.get(row[2], 0), Descending(row[-1]), row[0])
+
+
+def merge_counts(rows: List[tuple]) -> List[tuple]:
+    """合并各分片 GROUP BY 的 (key, count) 结果, 按 key 排序"""
+    totals: Dict[Any, int] = {}
+    for key, count in rows:
+        totals[key] = totals.get(key, 0) + count
+    return sorted(totals.items(), key=lambda item: (item[0] is not None, item[0]))
+
+
+STATUS_ICONS = {"todo": "🔴", "in_progress": "🟡", "completed": "✅"}
+PRIORITY_ICONS = {"low": "🟢", "medium": "🟡", "high": "🔴"}
+
+OUTPUT_FORMATS = ('table', 'json', 'jsonl', 'tsv')
+
+
+def print_notice(message: str, fmt: str = 'table'):
+    """输出提示或错误信息; 非 table 格式写到 stderr, stdout 只保留机器可读的结果"""
+    print(message, file=sys.stdout if fmt == 'table' else sys.stderr)
+
+
+class RowRenderer:
+    """把查询结果按 table/json/jsonl/tsv 格式流式写出
+
+    每行格式化为字符串后攒批一次写入 out, 避免逐行 print 的开销;
+    table 格式的表头、行格式和汇总行由调用方提供, 与原有输出一致
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, fmt: str, columns: Tuple[str, ...], out=None):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"无效输出格式: {fmt}. 有效格式: {', '.join(OUTPUT_FORMATS)}")
+        self.fmt = fmt
+        self.columns = columns
+        self.out = out or sys.stdout
+        # 复用编码器; json.dumps 传入非默认参数时每次调用都会新建一个
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def render(self, rows, table_row=None, header: Tuple[str, ...] = (), footer=None,
+               empty: Optional[str] = None) -> int:
+        """写出 rows 中的所有行, 返回行数
+
+        table_row(row) 返回 table 格式的一行; footer(count) 返回汇总行;
+        没有数据时 table 格式只输出 empty, 其他格式输出空结果
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None and self.fmt == 'table':
+            if empty is not None:
+                self.out.write(empty + '\n')
+            return 0
+
+        pending: List[str] = []
+        if self.fmt == 'table':
+            pending.extend(line + '\n' for line in header)
+        elif self.fmt == 'tsv':
+            pending.append('\t'.join(self.columns) + '\n')
+        elif self.fmt == 'json':
+            pending.append('[')
+
+        count = 0
+        for row in (chain((first,), rows) if first is not None else ()):
+            pending.append(self._format_row(row, table_row, count))
+            count += 1
+            if len(pending) >= self.BATCH_SIZE:
+                self.out.write(''.join(pending))
+                pending.clear()
+
+        if self.fmt == 'json':
+            pending.append('\n]\n' if count else ']\n')
+        elif self.fmt == 'table' and footer is not None:
+            pending.append(footer(count) + '\n')
+        self.out.write(''.join(pending))
+        return count
+
+    def _format_row(self, row, table_row, index: int) -> str:
+        if self.fmt == 'table':
+            return table_row(row) + '\n'
+        if self.fmt == 'tsv':
+            return '\t'.join('' if value is None else str(value).replace('\\', '\\\\')
+                             .replace('\t', '\\t').replace('\n', '\\n') for value in row) + '\n'
+        record = self._encode(dict(zip(self.columns, row)))
+        if self.fmt == 'jsonl':
+            return record + '\n'
+        return ('\n' if index == 0 else ',\n') + record
+
 
 class TodoManager:
-    def __init__(self, db_path: str = "/Users/cloudv/Desktop/todo-sqlite/simple.db"):
-        """初始化任务管理器"""
+    MAX_RETRIES = 3
+    # 只在一个事务中写入、提交后才输出的命令, 锁冲突时可以安全地整体重试
+    RETRYABLE_COMMANDS = ('create', 'update', 'status', 'delete', 'restore')
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, profile: bool = False,
+                 slow_query_ms: float = 100.0, slow_query_log: Optional[str] = None,
+                 shards: int = 1, compact: bool = False, delta: bool = False,
+                 snapshot: bool = False):
+        """初始化任务管理器
+
+        profile=True 时记录每条SQL的耗时和返回行数, 超过 slow_query_ms
+        的语句连同执行计划写入慢查询日志 (默认为数据库旁的 .slow.log 文件)
+
+        shards > 1 时任务按 task_uuid 哈希分布到多个数据库文件, 写操作只访问
+        一个分片, list/search/stats/export 在进程池中并行查询所有分片后归并
+
+        compact=True 时新建的数据库使用紧凑存储 (见 COMPACT_SCHEMA);
+        已有数据库的存储格式自动识别, 可用 migrate_compact() 原地转换
+
+        delta=True 时新建的数据库使用增量存储 (见 DELTA_SCHEMA), 每个版本只保存
+        变化的字段; 可用 migrate_delta() 原地转换
+
+        snapshot=True 时 db_path 是 backup() 生成的备份文件, 以只读、不可变方式
+        打开 (见 connect_database), 不创建表也不保存运行指标
+        """
+        if shards < 1:
+            raise ValueError(f"分片数必须大于0: {shards}")
+        if compact and delta:
+            raise ValueError("紧凑存储和增量存储不能同时使用")
         self.db_path = db_path
+        self.shard_paths = shard_paths_for(db_path, shards)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.compact = compact
+        self.delta = delta
+        self.snapshot = snapshot
+        self.profiler = None
+        self.metrics = MetricsRegistry()
+        self._rows_written = 0
+        if profile:
+            if slow_query_log is None:
+                slow_query_log = os.path.splitext(db_path)[0] + '.slow.log'
+            self.profiler = QueryProfiler(slow_query_ms, slow_query_log)
         self.init_database()
-    
+
+    def _shard_path(self, task_uuid: Optional[str] = None) -> str:
+        """任务所在的数据库文件; 未指定任务时为第一个分片"""
+        if task_uuid is None or len(self.shard_paths) == 1:
+            return self.shard_paths[0]
+        return self.shard_paths[shard_index(task_uuid, len(self.shard_paths))]
+
+    def _connect(self, task_uuid: Optional[str] = None, db_path: Optional[str] = None,
+                 snapshot: Optional[bool] = None) -> sqlite3.Connection:
+        """打开任务所在分片的连接; 开启分析时按调用的公开方法归类语句
+
+        snapshot 默认与管理器一致; 写入备份等新文件时传 False
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        conn = connect_database(db_path or self._shard_path(task_uuid), snapshot, factory=TodoConnection)
+        conn.on_commit = self._count_rows_written
+        if self.profiler is not None:
+            conn.profiler = self.profiler
+            conn.method = self._calling_method()
+        return conn
+
+    def _calling_method(self) -> str:
+        """向上查找调用栈中最近的 TodoManager 公开方法名 (跳过生成器表达式等匿名代码块)"""
+        frame = sys._getframe(2)
+        while frame is not None:
+            name = frame.f_code.co_name
+            if frame.f_locals.get('self') is self and not name.startswith(('_', '<')):
+                return name
+            frame = frame.f_back
+        return 'unknown'
+
+    @property
+    def storage_table(self) -> str:
+        """实际保存版本行的表"""
+        if self.delta:
+            return 'todo_delta'
+        return 'todo_compact' if self.compact else 'todo_unified'
+
+    def _task_filter(self, alias: str = '') -> str:
+        """按 task_uuid 精确匹配的条件 (参数为UUID文本)
+
+        紧凑存储时视图上的 task_uuid 是解码后的表达式, 无法使用索引,
+        因此改为通过 todo_compact 的 task_uuid 索引定位行
+        """
+        if self.compact:
+            return f"{alias}id IN (SELECT id FROM todo_compact WHERE task_uuid = todo_uuid_blob(?))"
+        return f"{alias}task_uuid = ?"
+
+    def _latest_join(self) -> str:
+        """把别名 u 限定为每个任务最新版本行的 JOIN 子句
+
+        紧凑/增量存储时在实际存储表上按原始列分组并按行ID连接, 避免在视图的
+        解码或重建表达式上做无索引的嵌套循环连接
+        """
+        if self.storage_table != 'todo_unified':
+            return f'''JOIN (
+                    SELECT c.id AS latest_id
+                    FROM {self.storage_table} c
+                    JOIN (
+                        SELECT task_uuid, MAX(version) as max_version
+                        FROM {self.storage_table}
+                        GROUP BY task_uuid
+                    ) m ON c.task_uuid = m.task_uuid AND c.version = m.max_version
+                ) latest ON u.id = latest.latest_id'''
+        return '''JOIN (
+                    SELECT task_uuid, MAX(version) as max_version
+                    FROM todo_unified 
+                    GROUP BY task_uuid
+                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version'''
+
+    def _append_version(self, cursor: sqlite3.Cursor, task_uuid: str, current_version: int,
+                        changes: Dict[str, Any], operation_type: str, change_summary: str):
+        """在 current_version 的基础上写入下一个版本 (单条语句)
+
+        changes 中的字段使用新值, 其余字段 (包括 due_date) 从当前版本继承。
+        增量存储时若 current_version 是最新版本且无需写检查点, 直接追加只含
+        变化字段的行, 不经过视图重建整行
+        """
+        if self.delta and None not in changes.values():
+            fields = [field for field in TASK_FIELDS if field in changes]
+            cursor.execute(f'''
+                INSERT INTO todo_delta (
+                    task_uuid, version, base_version, {''.join(f'{field}, ' for field in fields)}operation_type, change_summary
+                ) SELECT 
+                    task_uuid, version + 1, base_version, {''.join('?, ' for _ in fields)}?, ?
+                FROM todo_delta 
+                WHERE task_uuid = ? AND version = ?
+                AND version + 1 - base_version < {DELTA_CHECKPOINT_INTERVAL}
+                AND version = (SELECT MAX(version) FROM todo_delta WHERE task_uuid = ?)
+            ''', [changes[field] for field in fields]
+                  + [operation_type, change_summary, task_uuid, current_version, task_uuid])
+            if cursor.rowcount == 1:
+                return
+        
+        values = ', '.join('?' if field in changes else field for field in TASK_FIELDS)
+        cursor.execute(f'''
+            INSERT INTO todo_unified (
+                task_uuid, version, task, status, priority, due_date, operation_type, change_summary
+            ) SELECT 
+                task_uuid, version + 1, {values}, ?, ?
+            FROM todo_unified 
+            WHERE {self._task_filter()} AND version = ?
+        ''', [changes[field] for field in TASK_FIELDS if field in changes]
+              + [operation_type, change_summary, task_uuid, current_version])
+
+    def _raw_connect(self) -> sqlite3.Connection:
+        """打开不参与性能分析的连接 (指标表保存在第一个分片)"""
+        return connect_database(self.shard_paths[0], self.snapshot)
+
+    def _fetch_all(self, sql: str, params=(), key=None) -> List[tuple]:
+        """在所有分片上执行查询
+
+        单个数据库时直接查询; 多分片时通过进程池并行查询, 并按 key
+        归并各分片已排序的结果 (key 为 None 时直接拼接)。开启分析时每个分片
+        的语句按调用的公开方法各记录一条
+        """
+        if len(self.shard_paths) == 1:
+            with self._connect() as conn:
+                return conn.cursor().execute(sql, params).fetchall() or []
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=min(len(self.shard_paths), os.cpu_count() or 1))
+        timed = list(self._pool.map(_fetch_shard_rows, self.shard_paths, repeat(sql), repeat(params),
+                                    repeat(self.snapshot)))
+        results = [rows for rows, _ in timed]
+        if self.profiler is not None:
+            method = self._calling_method()
+            for rows, elapsed_ms in timed:
+                record = self.profiler.start(method, sql, params)
+                record['elapsed_ms'] = elapsed_ms
+                record['rows'] = len(rows)
+        if key is None:
+            return [row for rows in results for row in rows]
+        return list(heapq.merge(*results, key=key))
+
+    def _iter_rows(self, sql: str, params=(), key=None):
+        """与 _fetch_all 相同, 但单个数据库时边读取边产出, 不在内存中保存全部结果"""
+        if len(self.shard_paths) > 1:
+            yield from self._fetch_all(sql, params, key)
+            return
+        with self._connect() as conn:
+            cursor = conn.cursor().execute(sql, params)
+            while True:
+                batch = cursor.fetchmany(RowRenderer.BATCH_SIZE)
+                if not batch:
+                    return
+                yield from batch
+
+    def _count_rows_written(self, changes: int):
+        self._rows_written += changes
+
+    def run_command(self, command: str, func, *args):
+        """执行命令并记录耗时、写入行数和锁冲突重试次数
+
+        只有 RETRYABLE_COMMANDS 在锁冲突时重试; 其他命令可能已提交部分事务
+        (如导入时逐个分片提交) 或已输出结果, 重试会重复写入和输出, 因此直接报错。
+        func 返回 False 表示命令未被识别, 此时不记录指标
+        """
+        started = time.perf_counter()
+        written_before = self._rows_written
+        try:
+            if command in self.RETRYABLE_COMMANDS:
+                result = self._run_with_retries(command, func, args)
+            else:
+                result = func(*args)
+        except Exception:
+            self._record_command(command, started, written_before)
+            raise
+        if result is not False:
+            self._record_command(command, started, written_before)
+        return result
+
+    def _run_with_retries(self, command: str, func, args):
+        """数据库锁定时重试整个命令 (失败的事务已回滚)"""
+        attempt = 0
+        while True:
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as e:
+                retryable = 'locked' in str(e) or 'busy' in str(e)
+                if not retryable or attempt >= self.MAX_RETRIES:
+                    raise
+                attempt += 1
+                self.metrics.inc('transaction_retries', command)
+                time.sleep(0.05 * attempt)
+
+    def _record_command(self, command: str, started: float, written_before: int):
+        self.metrics.observe(command, time.perf_counter() - started)
+        written = self._rows_written - written_before
+        if written:
+            self.metrics.inc('rows_written', command, written)
+
+    def save_metrics(self):
+        """把本次运行的指标累加到 todo_metrics 表, 供后续调用和导出使用 (快照模式下不写入)"""
+        if self.snapshot:
+            return
+        with self._raw_connect() as conn:
+            self.metrics.save(conn)
+
+    def _file_sizes(self) -> Dict[str, int]:
+        """数据库及WAL文件大小"""
+        sizes = {'db': 0, 'wal': 0}
+        for db_path in self.shard_paths:
+            for file_kind, path in (('db', db_path), ('wal', db_path + '-wal')):
+                if os.path.exists(path):
+                    sizes[file_kind] += os.path.getsize(path)
+        return sizes
+
+    def export_metrics(self, filename: Optional[str] = None):
+        """以 Prometheus 文本格式导出累计指标; 指定文件时原子写入, 便于 node exporter 采集"""
+        self.save_metrics()
+        with self._connect(db_path=self.shard_paths[0]) as conn:
+            registry = MetricsRegistry.load(conn)
+        text = registry.render_prometheus(self._file_sizes())
+
+        if filename is None:
+            print(text, end='')
+            return
+
+        tmp_path = filename + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, filename)
+        print(f"✅ 指标已导出到: {filename}")
+
+    def close(self):
+        """关闭分片查询使用的进程池"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def print_profile(self, fmt: str = 'table'):
+        """输出本次运行的查询性能分析; 非 table 格式写到 stderr, 不混入机器可读的结果"""
+        if self.profiler is not None:
+            self.profiler.report(self._raw_connect, sys.stdout if fmt == 'table' else sys.stderr)
+
     def init_database(self):
-        """初始化数据库表结构"""
-        with sqlite3.connect(self.db_path) as conn:
+        """初始化数据库表结构 (每个分片一份); 快照模式下只识别存储格式"""
+        for index, db_path in enumerate(self.shard_paths):
+            if self.snapshot:
+                self._detect_snapshot(db_path)
+            else:
+                self._init_shard(db_path, index)
+
+    def _detect_snapshot(self, db_path: str):
+        with self._connect(db_path=db_path) as conn:
+            existing = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE name IN ('todo_unified', 'todo_compact', 'todo_delta')")}
+        if 'todo_unified' not in existing:
+            raise ValueError(f"快照中没有任务数据: {db_path}")
+        self.compact = 'todo_compact' in existing
+        self.delta = 'todo_delta' in existing
+
+    def _init_shard(self, db_path: str, index: int):
+        with self._connect(db_path=db_path) as conn:
             cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE name IN ('todo_unified', 'todo_compact', 'todo_delta')")
+            existing = {row[0] for row in cursor.fetchall()}
+            if 'todo_delta' in existing or (self.delta and 'todo_unified' not in existing):
+                self.compact, self.delta = False, True
+                for statement in DELTA_SCHEMA:
+                    cursor.execute(statement)
+            elif 'todo_compact' in existing or (self.compact and 'todo_unified' not in existing):
+                self.compact, self.delta = True, False
+                for statement in COMPACT_SCHEMA:
+                    cursor.execute(statement)
+            else:
+                self.compact, self.delta = False, False
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS todo_unified (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        task_uuid TEXT NOT NULL,
+                        version INTEGER DEFAULT 1,
+                        task TEXT NOT NULL,
+                        status TEXT CHECK(status IN ('todo', 'in_progress', 'completed')) DEFAULT 'todo',
+                        priority TEXT CHECK(priority IN ('low', 'medium', 'high')) DEFAULT 'medium',
+                        due_date DATE,
+                        operation_type TEXT CHECK(operation_type IN ('create', 'update', 'status_change', 'delete', 'restore', 'current_snapshot', 'migration')) DEFAULT 'update',
+                        change_summary TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_uuid ON todo_unified(task_uuid)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON todo_unified(status)')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS todo_unified (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task_uuid TEXT NOT NULL,
-                    version INTEGER DEFAULT 1,
-                    task TEXT NOT NULL,
-                    status TEXT CHECK(status IN ('todo', 'in_progress', 'completed')) DEFAULT 'todo',
-                    priority TEXT CHECK(priority IN ('low', 'medium', 'high')) DEFAULT 'medium',
-                    due_date DATE,
-                    operation_type TEXT CHECK(operation_type IN ('create', 'update', 'status_change', 'delete', 'restore', 'current_snapshot', 'migration')) DEFAULT 'update',
-                    change_summary TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
+                CREATE TABLE IF NOT EXISTS todo_metrics (
+                    metric TEXT NOT NULL,
+                    command TEXT NOT NULL,
+                    le TEXT NOT NULL DEFAULT '',
+                    value REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (metric, command, le)
+                ) WITHOUT ROWID
             ''')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_uuid ON todo_unified(task_uuid)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON todo_unified(status)')
+            if index > 0:
+                cursor.execute('''
+                    INSERT INTO sqlite_sequence (name, seq)
+                    SELECT ?, ?
+                    WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                ''', (self.storage_table, index << SHARD_ID_BITS, self.storage_table))
             conn.commit()
     
+    def migrate_compact(self):
+        """把现有数据库 (所有分片) 原地转换为紧凑存储, 完成后执行 VACUUM 回收空间"""
+        self._migrate_storage('todo_compact', COMPACT_SCHEMA)
+        self.compact, self.delta = True, False
+    
+    def migrate_delta(self):
+        """把现有数据库 (所有分片) 原地转换为增量存储, 完成后执行 VACUUM 回收空间
+
+        增量行需要版本号确定所属检查点, 存在版本号为空的行 (如导入的不完整记录)
+        时不转换, 提示先用 fsck --repair 修复
+        """
+        for db_path in self.shard_paths:
+            with self._connect(db_path=db_path) as conn:
+                missing = conn.execute('SELECT COUNT(*) FROM todo_unified WHERE version IS NULL').fetchone()[0]
+            if missing:
+                print(f"❌ {db_path} 中有 {missing} 条记录的版本号为空, 无法转换为增量存储")
+                print("💡 请先运行 'fsck --repair' 修复后再转换")
+                return
+        self._migrate_storage('todo_delta', DELTA_SCHEMA)
+        self.compact, self.delta = False, True
+    
+    def _migrate_storage(self, table: str, schema: List[str]):
+        """把文本存储的 todo_unified 表转换为 table + 视图 (schema), 行ID保持不变
+
+        每个分片的转换 (包括 DDL) 在一个 BEGIN IMMEDIATE 事务中完成, 失败或中断时
+        整体回滚, 数据仍在原来的 todo_unified 表中; 只有 VACUUM 在事务之外执行
+        """
+        for db_path in self.shard_paths:
+            size_before = os.path.getsize(db_path)
+            with self._connect(db_path=db_path) as conn:
+                # Python 默认不在 DDL 前开启事务, 改为手动控制事务
+                conn.isolation_level = None
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    cursor.execute("SELECT name FROM sqlite_master WHERE name IN ('todo_compact', 'todo_delta')")
+                    current = cursor.fetchone()
+                    if current:
+                        cursor.execute('ROLLBACK')
+                        print(f"📋 {db_path} 已使用 {current[0]} 存储, 只能从文本存储转换")
+                        continue
+                    
+                    cursor.execute("SELECT name FROM sqlite_master WHERE name = 'todo_changes'")
+                    had_change_log = cursor.fetchone() is not None
+                    for index_name in ('idx_task_uuid', 'idx_status', 'idx_updated_at'):
+                        cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+                    cursor.execute('ALTER TABLE todo_unified RENAME TO todo_unified_text')
+                    for statement in schema:
+                        cursor.execute(statement)
+                    
+                    # 经视图触发器写入, 与正常写入使用相同的编码和校验
+                    cursor.execute('INSERT INTO todo_unified SELECT * FROM todo_unified_text ORDER BY id')
+                    cursor.execute(f'SELECT COUNT(*) FROM {table}')
+                    migrated = cursor.fetchone()[0]
+                    cursor.execute('''
+                        UPDATE sqlite_sequence SET seq = MAX(seq, (
+                            SELECT seq FROM sqlite_sequence WHERE name = 'todo_unified_text'
+                        )) WHERE name = ?
+                    ''', (table,))
+                    cursor.execute('''
+                        INSERT INTO sqlite_sequence (name, seq)
+                        SELECT ?, seq FROM sqlite_sequence WHERE name = 'todo_unified_text'
+                        AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                    ''', (table, table))
+                    cursor.execute('DROP TABLE todo_unified_text')
+                    if had_change_log:
+                        # 修改日志的触发器随旧表删除, 在新的存储表上重建
+                        for statement in _change_log_schema(table):
+                            cursor.execute(statement)
+                    cursor.execute('COMMIT')
+                except BaseException:
+                    if conn.in_transaction:
+                        cursor.execute('ROLLBACK')
+                    raise
+            
+            vacuum = sqlite3.connect(db_path)
+            vacuum.execute('VACUUM')
+            vacuum.close()
+            size_after = os.path.getsize(db_path)
+            print(f"✅ {db_path}: 已转换 {migrated} 条记录, 文件大小 {size_before} → {size_after} 字节")
+    
     def show_help(self):
         """显示帮助信息"""
         help_text = """
@@ -60,6 +1249,8 @@ class TodoManager:
   show <task_uuid>        - 显示任务详情和完整历史
   create <task_name> [priority] - 创建新任务 (优先级: low/medium/high)
   update <task_uuid> <field> <value> - 更新任务信息 (field: task/priority/due_date)
+  update <task_uuid> [--task 名称] [--priority 优先级] [--due 日期] [--status 状态]
+                          - 同时修改多个字段, 只生成一个新版本
   status <task_uuid> <status> - 更新任务状态 (todo/in_progress/completed)
   
 🗑️ 删除和恢复:
@@ -79,8 +1270,30 @@ class TodoManager:
   
 💾 数据操作:
   export <file>           - 导出任务数据到JSON文件
+  backup <dest.db> [--pages n] [--sleep s] [--vacuum]
+                          - 在线热备份 (每步复制n页, 不长时间阻塞写入; --vacuum 生成紧凑副本)
   import <file>           - 从JSON文件导入任务数据
-  
+  watch [--since id] [--cursor file] [--interval s] [--once]
+                          - 以JSON Lines持续输出新增的版本行 (--cursor 保存读取位置以便续传)
+  replicate <follower.db>... [--follow] [--batch n]
+                          - 把任务日志复制到只读从库 (--lag 查看延迟, --check 校验一致性)
+  fsck [--repair] [--workers n] [--report file]
+                          - 并行检查版本日志完整性并输出JSON报告 (--repair 修复问题)
+  migrate_compact         - 把数据库原地转换为紧凑存储 (二进制UUID、整数枚举)
+  migrate_delta           - 把数据库原地转换为增量存储 (每个版本只保存变化的字段)
+  benchmark [rows]        - 比较文本存储与紧凑存储的文件大小和查询速度
+  metrics [file]          - 导出Prometheus格式的命令延迟和写入指标 (默认输出到终端)
+
+⚙️ 全局选项 (可放在命令前后):
+  --profile               - 记录每条SQL的耗时和行数, 命令结束后输出分析
+  --slow-ms <ms>          - 慢查询阈值 (默认100ms), 慢查询及执行计划写入 .slow.log
+  --db <file>             - 指定数据库文件
+  --shards <n>            - 按任务UUID分布到n个分片文件 (每次调用需使用相同的n)
+  --compact               - 新建数据库时使用紧凑存储 (已有数据库自动识别)
+  --delta                 - 新建数据库时使用增量存储 (已有数据库自动识别)
+  --format <fmt>          - 只读命令的输出格式: table (默认) / json / jsonl / tsv
+  --snapshot <file>       - 以只读、不可变方式打开 backup 生成的备份 (mmap 读取, 用于统计分析)
+
 ───────────────────────────────────────────────────────────────────────────────
 💡 示例用法:
   python3 todo_manager.py create "完成项目文档" high
@@ -105,87 +1318,12 @@ class TodoManager:
         """清屏"""
         os.system('clear' if os.name == 'posix' else 'cls')
     
-    def list_tasks(self, status_filter: Optional[str] = None):
+    def list_tasks(self, status_filter: Optional[str] = None, fmt: str = 'table'):
         """列出任务"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            if status_filter:
-                cursor.execute('''
-                    SELECT 
-                        u.task_uuid,
-                        u.task,
-                        u.status,
-                        u.priority,
-                        u.due_date,
-                        u.version as current_version,
-                        u.created_at as last_updated
-                    FROM todo_unified u
-                    JOIN (
-                        SELECT task_uuid, MAX(version) as max_version
-                        FROM todo_unified 
-                        GROUP BY task_uuid
-                    ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                    WHERE u.operation_type != 'delete' AND u.status = ?
-                    ORDER BY 
-                        CASE u.status 
-                            WHEN 'in_progress' THEN 1
-                            WHEN 'todo' THEN 2
-                            WHEN 'completed' THEN 3
-                        END,
-                        u.created_at DESC
-                ''', (status_filter,))
-            else:
-                cursor.execute('''
-                    SELECT 
-                        u.task_uuid,
-                        u.task,
-                        u.status,
-                        u.priority,
-                        u.due_date,
-                        u.version as current_version,
-                        u.created_at as last_updated
-                    FROM todo_unified u
-                    JOIN (
-                        SELECT task_uuid, MAX(version) as max_version
-                        FROM todo_unified 
-                        GROUP BY task_uuid
-                    ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                    WHERE u.operation_type != 'delete'
-                    ORDER BY 
-                        CASE u.status 
-                            WHEN 'in_progress' THEN 1
-                            WHEN 'todo' THEN 2
-                            WHEN 'completed' THEN 3
-                        END,
-                        u.created_at DESC
-                ''')
-            
-            tasks = cursor.fetchall() or []
-            
-            if not tasks:
-                print("📋 暂无任务")
-                return
-            
-            # 显示表头
-            print(f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'优先级':<8} {'版本':<6}")
-            print("─" * 100)
-            
-            for task in tasks:
-                status_icon = {"todo": "🔴", "in_progress": "🟡", "completed": "✅"}
-                priority_icons = {"low": "🟢", "medium": "🟡", "high": "🔴"}
-                
-                print(f"{task[0]:<36} {task[1]:<30} {status_icon.get(task[2], '❓')}{task[2]:<11} {priority_icons.get(task[3], '❓')}{task[3]:<7} {task[5]}")
-            
-            print(f"\n📊 总计: {len(tasks)} 个任务")
-    
-    def show_task(self, task_uuid: str):
-        """显示任务详情"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 获取任务基本信息
-            cursor.execute('''
+        renderer = RowRenderer(fmt, ('task_uuid', 'task', 'status', 'priority', 'due_date',
+                                     'version', 'last_updated'))
+        if status_filter:
+            tasks = self._iter_rows(f'''
                 SELECT 
                     u.task_uuid,
                     u.task,
@@ -195,35 +1333,87 @@ class TodoManager:
                     u.version as current_version,
                     u.created_at as last_updated
                 FROM todo_unified u
-                JOIN (
-                    SELECT task_uuid, MAX(version) as max_version
-                    FROM todo_unified 
-                    GROUP BY task_uuid
-                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                WHERE u.task_uuid = ? AND u.operation_type != 'delete'
-            ''', (task_uuid,))
-            
-            task_info = cursor.fetchone()
-            
-            if not task_info:
-                print(f"❌ 未找到UUID为 {task_uuid} 的任务或任务已删除")
-                return
-            
-            # 获取完整历史
-            cursor.execute('''
-                SELECT 
+                {self._latest_join()}
+                WHERE u.operation_type != 'delete' AND u.status = ?
+                ORDER BY 
+                    CASE u.status 
+                        WHEN 'in_progress' THEN 1
+                        WHEN 'todo' THEN 2
+                        WHEN 'completed' THEN 3
+                    END,
+                    u.created_at DESC,
+                    u.task_uuid
+            ''', (status_filter,), key=task_list_order)
+        else:
+            tasks = self._iter_rows(f'''
+                SELECT 
+                    u.task_uuid,
+                    u.task,
+                    u.status,
+                    u.priority,
+                    u.due_date,
+                    u.version as current_version,
+                    u.created_at as last_updated
+                FROM todo_unified u
+                {self._latest_join()}
+                WHERE u.operation_type != 'delete'
+                ORDER BY 
+                    CASE u.status 
+                        WHEN 'in_progress' THEN 1
+                        WHEN 'todo' THEN 2
+                        WHEN 'completed' THEN 3
+                    END,
+                    u.created_at DESC,
+                    u.task_uuid
+            ''', key=task_list_order)
+        
+        renderer.render(
+            tasks,
+            table_row=lambda task: f"{task[0]:<36} {task[1]:<30} {STATUS_ICONS.get(task[2], '❓')}{task[2]:<11} {PRIORITY_ICONS.get(task[3], '❓')}{task[3]:<7} {task[5]}",
+            header=(f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'优先级':<8} {'版本':<6}", "─" * 100),
+            footer=lambda count: f"\n📊 总计: {count} 个任务",
+            empty="📋 暂无任务",
+        )
+    
+    def show_task(self, task_uuid: str, fmt: str = 'table'):
+        """显示任务详情 (非 table 格式输出每个版本的完整字段, 最后一行即当前状态)"""
+        renderer = RowRenderer(fmt, ('version', 'status', 'operation_type', 'change_summary', 'created_at',
+                                     'task_uuid', 'task', 'priority', 'due_date'))
+        with self._connect(task_uuid) as conn:
+            cursor = conn.cursor()
+            
+            # 一次查询取出完整历史, 最后一个版本即任务当前信息
+            cursor.execute(f'''
+                SELECT 
                     version,
                     status,
                     operation_type,
                     change_summary,
-                    created_at
+                    created_at,
+                    task_uuid,
+                    task,
+                    priority,
+                    due_date
                 FROM todo_unified 
-                WHERE task_uuid = ?
+                WHERE {self._task_filter()}
                 ORDER BY version
             ''', (task_uuid,))
             
             history = cursor.fetchall() or []
             
+            if not history or history[-1][2] == 'delete':
+                print_notice(f"❌ 未找到UUID为 {task_uuid} 的任务或任务已删除", fmt)
+                if fmt != 'table':
+                    renderer.render([])
+                return
+            
+            if fmt != 'table':
+                renderer.render(history)
+                return
+            
+            latest = history[-1]
+            task_info = (latest[5], latest[6], latest[1], latest[7], latest[8], latest[0], latest[4])
+            
             # 显示任务信息
             print(f"\n📋 任务详情:")
             print(f"UUID: {task_info[0]}")
@@ -234,20 +1424,17 @@ class TodoManager:
             print(f"最后更新: {task_info[6]}")
             
             print(f"\n📜 变更历史:")
-            if not history:
-                print("📝 暂无变更历史")
-            else:
-                print(f"{'版本':<6} {'状态':<12} {'操作类型':<15} {'变更说明':<30} {'时间':<20}")
-                print("─" * 90)
-                
-                for record in history:
-                    print(f"{record[0]:<6} {record[1]:<12} {record[2]:<15} {record[3]:<30} {record[4]}")
+            print(f"{'版本':<6} {'状态':<12} {'操作类型':<15} {'变更说明':<30} {'时间':<20}")
+            print("─" * 90)
+            
+            for record in history:
+                print(f"{record[0]:<6} {record[1]:<12} {record[2]:<15} {record[3]:<30} {record[4]}")
     
     def create_task(self, task_name: str, priority: str = "medium"):
         """创建新任务"""
         task_uuid = str(uuid.uuid4())
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(task_uuid) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO todo_unified (
@@ -268,44 +1455,66 @@ class TodoManager:
             print(f"❌ 无效字段: {field}. 有效字段: {', '.join(valid_fields)}")
             return
         
-        with sqlite3.connect(self.db_path) as conn:
+        self.update_fields(task_uuid, {field: value})
+    
+    def update_fields(self, task_uuid: str, changes: Dict[str, str]) -> bool:
+        """一次修改多个字段 (task/priority/due_date/status), 只生成一个新版本
+
+        先校验全部字段, 任一无效则不写入; 返回是否写入成功
+        """
+        error = self._validate_changes(changes)
+        if error:
+            print(f"❌ {error}")
+            return False
+        
+        changes = {field: changes[field] for field in TASK_FIELDS if field in changes}
+        summary = ', '.join(f"{field}: {value}" for field, value in changes.items())
+        
+        with self._connect(task_uuid) as conn:
             cursor = conn.cursor()
             
             # 检查任务是否存在且未删除
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT MAX(version), status FROM todo_unified 
-                WHERE task_uuid = ? AND operation_type != 'delete'
+                WHERE {self._task_filter()} AND operation_type != 'delete'
                 GROUP BY task_uuid
             ''', (task_uuid,))
             
             result = cursor.fetchone()
             if not result:
                 print(f"❌ 未找到UUID为 {task_uuid} 的任务或任务已删除")
-                return
+                return False
             
             current_version, current_status = result
-            new_version = current_version + 1
-            
-            # 插入新版本记录
-            cursor.execute('''
-                INSERT INTO todo_unified (
-                    task_uuid, version, task, status, priority, due_date, operation_type, change_summary
-                ) SELECT 
-                    ?, ?, task, ?, priority, due_date, 'update', ?
-                FROM todo_unified 
-                WHERE task_uuid = ? AND version = ?
-            ''', (task_uuid, new_version, current_status, f"Updated {field}: {value}", task_uuid, current_version))
             
-            # 更新具体字段
-            if field == 'task':
-                cursor.execute('UPDATE todo_unified SET task = ?, updated_at = CURRENT_TIMESTAMP WHERE task_uuid = ? AND version = ?', (value, task_uuid, new_version))
-            elif field == 'priority':
-                cursor.execute('UPDATE todo_unified SET priority = ?, updated_at = CURRENT_TIMESTAMP WHERE task_uuid = ? AND version = ?', (value, task_uuid, new_version))
-            elif field == 'due_date':
-                cursor.execute('UPDATE todo_unified SET due_date = ?, updated_at = CURRENT_TIMESTAMP WHERE task_uuid = ? AND version = ?', (value, task_uuid, new_version))
+            # 插入带新字段值的版本记录
+            self._append_version(cursor, task_uuid, current_version, changes,
+                                 'update', f"Updated {summary}")
             
             conn.commit()
-            print(f"✅ 任务更新成功: {field} = {value}")
+            print(f"✅ 任务更新成功: {', '.join(f'{field} = {value}' for field, value in changes.items())}")
+            return True
+    
+    @staticmethod
+    def _validate_changes(changes: Dict[str, str]) -> Optional[str]:
+        """校验待修改的字段, 返回第一个错误信息 (全部有效时返回 None)"""
+        if not changes:
+            return f"请至少指定一个要修改的字段: {', '.join(TASK_FIELDS)}"
+        for field, value in changes.items():
+            if field not in TASK_FIELDS:
+                return f"无效字段: {field}. 有效字段: {', '.join(TASK_FIELDS)}"
+            if field == 'task' and not value:
+                return "任务名称不能为空"
+            if field == 'status' and value not in STATUS_VALUES:
+                return f"无效状态: {value}. 有效状态: {', '.join(STATUS_VALUES)}"
+            if field == 'priority' and value not in PRIORITY_VALUES:
+                return f"无效优先级: {value}. 有效优先级: {', '.join(PRIORITY_VALUES)}"
+            if field == 'due_date':
+                try:
+                    datetime.strptime(value, '%Y-%m-%d')
+                except (TypeError, ValueError):
+                    return f"无效日期: {value}. 日期格式: YYYY-MM-DD"
+        return None
     
     def update_status(self, task_uuid: str, new_status: str):
         """更新任务状态"""
@@ -314,13 +1523,13 @@ class TodoManager:
             print(f"❌ 无效状态: {new_status}. 有效状态: {', '.join(valid_statuses)}")
             return
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(task_uuid) as conn:
             cursor = conn.cursor()
             
             # 检查任务是否存在且未删除
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT MAX(version), status, task, priority FROM todo_unified 
-                WHERE task_uuid = ? AND operation_type != 'delete'
+                WHERE {self._task_filter()} AND operation_type != 'delete'
                 GROUP BY task_uuid
             ''', (task_uuid,))
             
@@ -333,15 +1542,8 @@ class TodoManager:
             new_version = current_version + 1
             
             # 插入新状态记录
-            cursor.execute('''
-                INSERT INTO todo_unified (
-                    task_uuid, version, task, status, priority, operation_type, change_summary
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                task_uuid, new_version, task_name, new_status, priority, 
-                'status_change', 
-                f"Status changed from {current_status} to {new_status}"
-            ))
+            self._append_version(cursor, task_uuid, current_version, {'status': new_status},
+                                 'status_change', f"Status changed from {current_status} to {new_status}")
             
             conn.commit()
             print(f"✅ 状态更新成功: {current_status} → {new_status}")
@@ -350,13 +1552,13 @@ class TodoManager:
     
     def delete_task(self, task_uuid: str):
         """软删除任务"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(task_uuid) as conn:
             cursor = conn.cursor()
             
             # 检查任务是否存在且未删除
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT MAX(version), task, status, priority FROM todo_unified 
-                WHERE task_uuid = ? AND operation_type != 'delete'
+                WHERE {self._task_filter()} AND operation_type != 'delete'
                 GROUP BY task_uuid
             ''', (task_uuid,))
             
@@ -366,18 +1568,10 @@ class TodoManager:
                 return
             
             current_version, task_name, current_status, priority = result
-            new_version = current_version + 1
             
             # 插入删除记录
-            cursor.execute('''
-                INSERT INTO todo_unified (
-                    task_uuid, version, task, status, priority, operation_type, change_summary
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                task_uuid, new_version, task_name, current_status, priority, 
-                'delete', 
-                f"Task deleted: {task_name}"
-            ))
+            self._append_version(cursor, task_uuid, current_version, {},
+                                 'delete', f"Task deleted: {task_name}")
             
             conn.commit()
             print(f"🗑️ 任务删除成功: {task_name}")
@@ -386,13 +1580,13 @@ class TodoManager:
     
     def restore_task(self, task_uuid: str):
         """恢复已删除的任务"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(task_uuid) as conn:
             cursor = conn.cursor()
             
             # 检查是否存在删除记录
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT MAX(version), task, status, priority FROM todo_unified 
-                WHERE task_uuid = ?
+                WHERE {self._task_filter()}
                 GROUP BY task_uuid
             ''', (task_uuid,))
             
@@ -404,9 +1598,9 @@ class TodoManager:
             current_version, task_name, current_status, priority = result
             
             # 检查最后一条记录是否是删除操作
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT operation_type FROM todo_unified 
-                WHERE task_uuid = ? AND version = ?
+                WHERE {self._task_filter()} AND version = ?
             ''', (task_uuid, current_version))
             
             last_operation = cursor.fetchone()
@@ -414,18 +1608,9 @@ class TodoManager:
                 print(f"❌ 任务 {task_uuid} 尚未删除，无法恢复")
                 return
             
-            new_version = current_version + 1
-            
             # 插入恢复记录
-            cursor.execute('''
-                INSERT INTO todo_unified (
-                    task_uuid, version, task, status, priority, operation_type, change_summary
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                task_uuid, new_version, task_name, current_status, priority, 
-                'restore', 
-                f"Task restored: {task_name}"
-            ))
+            self._append_version(cursor, task_uuid, current_version, {},
+                                 'restore', f"Task restored: {task_name}")
             
             conn.commit()
             print(f"♻️ 任务恢复成功: {task_name}")
@@ -434,157 +1619,119 @@ class TodoManager:
     
     def clear_completed_tasks(self):
         """清除所有已完成的任务"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 获取所有已完成的任务
-            cursor.execute('''
-                SELECT 
-                    u.task_uuid,
-                    u.task,
-                    u.version as current_version
-                FROM todo_unified u
-                JOIN (
-                    SELECT task_uuid, MAX(version) as max_version
-                    FROM todo_unified 
-                    GROUP BY task_uuid
-                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                WHERE u.status = 'completed' AND u.operation_type != 'delete'
-            ''')
-            
-            completed_tasks = cursor.fetchall() or []
-            
-            if not completed_tasks:
-                print("📋 没有已完成的任务需要清除")
-                return
-            
-            print(f"🧹 找到 {len(completed_tasks)} 个已完成的任务")
-            
-            # 批量删除
-            deleted_count = 0
-            for task_uuid, task_name, current_version in completed_tasks:
-                new_version = current_version + 1
-                cursor.execute('''
-                    INSERT INTO todo_unified (
-                        task_uuid, version, task, status, priority, operation_type, change_summary
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    task_uuid, new_version, task_name, 'completed', 'medium', 
-                    'delete', 
-                    f"Completed task cleared: {task_name}"
-                ))
-                deleted_count += 1
-            
-            conn.commit()
-            print(f"✅ 已清除 {deleted_count} 个已完成的任务")
+        deleted_count = 0
+        for db_path in self.shard_paths:
+            with self._connect(db_path=db_path) as conn:
+                cursor = conn.cursor()
+                
+                # 获取所有已完成的任务
+                cursor.execute(f'''
+                    SELECT 
+                        u.task_uuid,
+                        u.task,
+                        u.version as current_version
+                    FROM todo_unified u
+                    {self._latest_join()}
+                    WHERE u.status = 'completed' AND u.operation_type != 'delete'
+                ''')
+                
+                completed_tasks = cursor.fetchall() or []
+                
+                # 批量删除
+                for task_uuid, task_name, current_version in completed_tasks:
+                    self._append_version(cursor, task_uuid, current_version, {},
+                                         'delete', f"Completed task cleared: {task_name}")
+                    deleted_count += 1
+                
+                conn.commit()
+        
+        if not deleted_count:
+            print("📋 没有已完成的任务需要清除")
+            return
+        
+        print(f"🧹 找到 {deleted_count} 个已完成的任务")
+        print(f"✅ 已清除 {deleted_count} 个已完成的任务")
     
-    def filter_by_status(self, status: str):
+    def filter_by_status(self, status: str, fmt: str = 'table'):
         """按状态筛选任务"""
         if status not in ['todo', 'in_progress', 'completed']:
-            print(f"❌ 无效状态: {status}. 有效状态: todo/in_progress/completed")
+            print_notice(f"❌ 无效状态: {status}. 有效状态: todo/in_progress/completed", fmt)
             return
         
-        self.list_tasks(status_filter=status)
+        self.list_tasks(status_filter=status, fmt=fmt)
     
-    def filter_by_priority(self, priority: str):
+    def filter_by_priority(self, priority: str, fmt: str = 'table'):
         """按优先级筛选任务"""
         valid_priorities = ['low', 'medium', 'high']
         if priority not in valid_priorities:
-            print(f"❌ 无效优先级: {priority}. 有效优先级: {', '.join(valid_priorities)}")
+            print_notice(f"❌ 无效优先级: {priority}. 有效优先级: {', '.join(valid_priorities)}", fmt)
             return
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT 
-                    u.task_uuid,
-                    u.task,
-                    u.status,
-                    u.priority,
-                    u.version as current_version,
-                    u.created_at as last_updated
-                FROM todo_unified u
-                JOIN (
-                    SELECT task_uuid, MAX(version) as max_version
-                    FROM todo_unified 
-                    GROUP BY task_uuid
-                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                WHERE u.operation_type != 'delete' AND u.priority = ?
-                ORDER BY 
-                    CASE u.status 
-                        WHEN 'in_progress' THEN 1
-                        WHEN 'todo' THEN 2
-                        WHEN 'completed' THEN 3
-                    END,
-                    u.created_at DESC
-            ''', (priority,))
-            
-            tasks = cursor.fetchall() or []
-            
-            if not tasks:
-                print(f"📋 暂无 {priority} 优先级的任务")
-                return
-            
-            print(f"🎯 {priority} 优先级任务:")
-            print(f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'版本':<6}")
-            print("─" * 90)
-            
-            for task in tasks:
-                status_icon = {"todo": "🔴", "in_progress": "🟡", "completed": "✅"}
-                priority_icons = {"low": "🟢", "medium": "🟡", "high": "🔴"}
-                
-                print(f"{task[0]:<36} {task[1]:<30} {status_icon.get(task[2], '❓')}{task[2]:<11} {priority_icons.get(task[3], '❓')}{task[3]:<7} {task[4]}")
-            
-            print(f"\n📊 总计: {len(tasks)} 个 {priority} 优先级任务")
+        renderer = RowRenderer(fmt, ('task_uuid', 'task', 'status', 'priority', 'version', 'last_updated'))
+        tasks = self._iter_rows(f'''
+            SELECT 
+                u.task_uuid,
+                u.task,
+                u.status,
+                u.priority,
+                u.version as current_version,
+                u.created_at as last_updated
+            FROM todo_unified u
+            {self._latest_join()}
+            WHERE u.operation_type != 'delete' AND u.priority = ?
+            ORDER BY 
+                CASE u.status 
+                    WHEN 'in_progress' THEN 1
+                    WHEN 'todo' THEN 2
+                    WHEN 'completed' THEN 3
+                END,
+                u.created_at DESC,
+                u.task_uuid
+        ''', (priority,), key=task_list_order)
+        
+        renderer.render(
+            tasks,
+            table_row=lambda task: f"{task[0]:<36} {task[1]:<30} {STATUS_ICONS.get(task[2], '❓')}{task[2]:<11} {PRIORITY_ICONS.get(task[3], '❓')}{task[3]:<7} {task[4]}",
+            header=(f"🎯 {priority} 优先级任务:",
+                    f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'版本':<6}", "─" * 90),
+            footer=lambda count: f"\n📊 总计: {count} 个 {priority} 优先级任务",
+            empty=f"📋 暂无 {priority} 优先级的任务",
+        )
     
-    def show_overdue_tasks(self):
+    def show_overdue_tasks(self, fmt: str = 'table'):
         """显示逾期任务"""
         today = datetime.now().strftime('%Y-%m-%d')
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT 
-                    u.task_uuid,
-                    u.task,
-                    u.status,
-                    u.due_date,
-                    u.version as current_version
-                FROM todo_unified u
-                JOIN (
-                    SELECT task_uuid, MAX(version) as max_version
-                    FROM todo_unified 
-                    GROUP BY task_uuid
-                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                WHERE u.operation_type != 'delete' AND u.due_date < ? AND u.status != 'completed'
-                ORDER BY u.due_date ASC
-            ''', (today,))
-            
-            overdue_tasks = cursor.fetchall() or []
-            
-            if not overdue_tasks:
-                print("🎉 没有逾期任务！")
-                return
-            
-            print(f"⏰ 逾期任务 (截止日期早于 {today}):")
-            print(f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'截止日期':<12}")
-            print("─" * 95)
-            
-            for task in overdue_tasks:
-                status_icon = {"todo": "🔴", "in_progress": "🟡", "completed": "✅"}
-                
-                print(f"{task[0]:<36} {task[1]:<30} {status_icon.get(task[2], '❓')}{task[2]:<11} {task[3]}")
-            
-            print(f"\n📊 总计: {len(overdue_tasks)} 个逾期任务")
+        renderer = RowRenderer(fmt, ('task_uuid', 'task', 'status', 'due_date', 'version'))
+        overdue_tasks = self._iter_rows(f'''
+            SELECT 
+                u.task_uuid,
+                u.task,
+                u.status,
+                u.due_date,
+                u.version as current_version
+            FROM todo_unified u
+            {self._latest_join()}
+            WHERE u.operation_type != 'delete' AND u.due_date < ? AND u.status != 'completed'
+            ORDER BY u.due_date ASC, u.task_uuid
+        ''', (today,), key=lambda row: (row[3], row[0]))
+        
+        renderer.render(
+            overdue_tasks,
+            table_row=lambda task: f"{task[0]:<36} {task[1]:<30} {STATUS_ICONS.get(task[2], '❓')}{task[2]:<11} {task[3]}",
+            header=(f"⏰ 逾期任务 (截止日期早于 {today}):",
+                    f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'截止日期':<12}", "─" * 95),
+            footer=lambda count: f"\n📊 总计: {count} 个逾期任务",
+            empty="🎉 没有逾期任务！",
+        )
     
-    def show_history(self, task_uuid: str):
+    def show_history(self, task_uuid: str, fmt: str = 'table'):
         """显示任务历史"""
-        with sqlite3.connect(self.db_path) as conn:
+        renderer = RowRenderer(fmt, ('version', 'status', 'operation_type', 'change_summary', 'created_at'))
+        with self._connect(task_uuid) as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     version,
                     status,
@@ -592,144 +1739,115 @@ class TodoManager:
                     change_summary,
                     created_at
                 FROM todo_unified 
-                WHERE task_uuid = ?
+                WHERE {self._task_filter()}
                 ORDER BY version
             ''', (task_uuid,))
             
-            history = cursor.fetchall() or []
-            
-            if not history:
-                print(f"❌ 未找到UUID为 {task_uuid} 的任务历史")
-                return
-            
-            print(f"📜 任务历史 (UUID: {task_uuid})")
-            print(f"{'版本':<6} {'状态':<12} {'操作类型':<15} {'变更说明':<35} {'时间':<20}")
-            print("─" * 95)
-            
-            for record in history:
-                print(f"{record[0]:<6} {record[1]:<12} {record[2]:<15} {record[3]:<35} {record[4]}")
+            renderer.render(
+                cursor,
+                table_row=lambda record: f"{record[0]:<6} {record[1]:<12} {record[2]:<15} {record[3]:<35} {record[4]}",
+                header=(f"📜 任务历史 (UUID: {task_uuid})",
+                        f"{'版本':<6} {'状态':<12} {'操作类型':<15} {'变更说明':<35} {'时间':<20}", "─" * 95),
+                empty=f"❌ 未找到UUID为 {task_uuid} 的任务历史",
+            )
     
-    def search_tasks(self, keyword: str):
+    def search_tasks(self, keyword: str, fmt: str = 'table'):
         """搜索任务"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT 
-                    u.task_uuid,
-                    u.task,
-                    u.status,
-                    u.priority,
-                    u.version as current_version
-                FROM todo_unified u
-                JOIN (
-                    SELECT task_uuid, MAX(version) as max_version
-                    FROM todo_unified 
-                    GROUP BY task_uuid
-                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                WHERE u.operation_type != 'delete' AND u.task LIKE ?
-                ORDER BY u.version DESC
-            ''', (f'%{keyword}%',))
-            
-            results = cursor.fetchall() or []
-            
-            if not results:
-                print(f"🔍 未找到包含关键词 '{keyword}' 的任务")
-                return
-            
-            print(f"🔍 搜索结果 (关键词: {keyword})")
-            print(f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'优先级':<8}")
-            print("─" * 90)
-            
-            for result in results:
-                status_icon = {"todo": "🔴", "in_progress": "🟡", "completed": "✅"}
-                priority_icons = {"low": "🟢", "medium": "🟡", "high": "🔴"}
-                
-                print(f"{result[0]:<36} {result[1]:<30} {status_icon.get(result[2], '❓')}{result[2]:<11} {priority_icons.get(result[3], '❓')}{result[3]:<7}")
-            
-            print(f"\n📊 找到 {len(results)} 个匹配的任务")
+        renderer = RowRenderer(fmt, ('task_uuid', 'task', 'status', 'priority', 'version'))
+        results = self._iter_rows(f'''
+            SELECT 
+                u.task_uuid,
+                u.task,
+                u.status,
+                u.priority,
+                u.version as current_version
+            FROM todo_unified u
+            {self._latest_join()}
+            WHERE u.operation_type != 'delete' AND u.task LIKE ?
+            ORDER BY u.version DESC, u.task_uuid
+        ''', (f'%{keyword}%',), key=lambda row: (Descending(row[4]), row[0]))
+        
+        renderer.render(
+            results,
+            table_row=lambda result: f"{result[0]:<36} {result[1]:<30} {STATUS_ICONS.get(result[2], '❓')}{result[2]:<11} {PRIORITY_ICONS.get(result[3], '❓')}{result[3]:<7}",
+            header=(f"🔍 搜索结果 (关键词: {keyword})",
+                    f"{'任务UUID':<36} {'任务名称':<30} {'状态':<12} {'优先级':<8}", "─" * 90),
+            footer=lambda count: f"\n📊 找到 {count} 个匹配的任务",
+            empty=f"🔍 未找到包含关键词 '{keyword}' 的任务",
+        )
     
-    def show_stats(self):
+    def show_stats(self, fmt: str = 'table'):
         """显示统计信息"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 状态统计
-            cursor.execute('''
-                SELECT 
-                    u.status,
-                    COUNT(DISTINCT u.task_uuid) as count
-                FROM todo_unified u
-                JOIN (
-                    SELECT task_uuid, MAX(version) as max_version
-                    FROM todo_unified 
-                    GROUP BY task_uuid
-                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                WHERE u.operation_type != 'delete'
-                GROUP BY u.status
-            ''')
-            
-            status_stats = cursor.fetchall() or []
-            
-            # 优先级统计
-            cursor.execute('''
-                SELECT 
-                    u.priority,
-                    COUNT(DISTINCT u.task_uuid) as count
-                FROM todo_unified u
-                JOIN (
-                    SELECT task_uuid, MAX(version) as max_version
-                    FROM todo_unified 
-                    GROUP BY task_uuid
-                ) latest ON u.task_uuid = latest.task_uuid AND u.version = latest.max_version
-                WHERE u.operation_type != 'delete'
-                GROUP BY u.priority
-            ''')
-            
-            priority_stats = cursor.fetchall() or []
-            
-            # 总版本数
-            cursor.execute('SELECT COUNT(*) FROM todo_unified')
-            total_versions = cursor.fetchone()[0]
-            
-            print("📊 任务统计信息")
-            print("=" * 50)
-            
-            print("\n🎯 按状态分布:")
-            for status, count in status_stats:
-                status_icon = {"todo": "🔴", "in_progress": "🟡", "completed": "✅"}
-                print(f"  {status_icon.get(status, '❓')} {status}: {count} 个")
-            
-            print("\n📈 按优先级分布:")
-            for priority, count in priority_stats:
-                priority_icons = {"low": "🟢", "medium": "🟡", "high": "🔴"}
-                print(f"  {priority_icons.get(priority, '❓')} {priority}: {count} 个")
-            
-            print(f"\n💾 数据统计:")
-            print(f"  📋 任务版本总数: {total_versions}")
+        renderer = RowRenderer(fmt, ('group', 'key', 'count'))
+        # 状态统计
+        status_stats = merge_counts(self._fetch_all(f'''
+            SELECT 
+                u.status,
+                COUNT(DISTINCT u.task_uuid) as count
+            FROM todo_unified u
+            {self._latest_join()}
+            WHERE u.operation_type != 'delete'
+            GROUP BY u.status
+        '''))
+        
+        # 优先级统计
+        priority_stats = merge_counts(self._fetch_all(f'''
+            SELECT 
+                u.priority,
+                COUNT(DISTINCT u.task_uuid) as count
+            FROM todo_unified u
+            {self._latest_join()}
+            WHERE u.operation_type != 'delete'
+            GROUP BY u.priority
+        '''))
+        
+        # 总版本数
+        total_versions = sum(row[0] for row in self._fetch_all('SELECT COUNT(*) FROM todo_unified'))
+        
+        if fmt != 'table':
+            renderer.render(chain(
+                (('status', status, count) for status, count in status_stats),
+                (('priority', priority, count) for priority, count in priority_stats),
+                [('versions', 'total', total_versions)],
+            ))
+            return
+        
+        print("📊 任务统计信息")
+        print("=" * 50)
+        
+        print("\n🎯 按状态分布:")
+        for status, count in status_stats:
+            print(f"  {STATUS_ICONS.get(status, '❓')} {status}: {count} 个")
+        
+        print("\n📈 按优先级分布:")
+        for priority, count in priority_stats:
+            print(f"  {PRIORITY_ICONS.get(priority, '❓')} {priority}: {count} 个")
+        
+        print(f"\n💾 数据统计:")
+        print(f"  📋 任务版本总数: {total_versions}")
     
     def export_data(self, filename: str):
         """导出数据"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM todo_unified ORDER BY task_uuid, version')
-            all_records = cursor.fetchall() or []
-            
-            # 获取列名
-            column_names = [description[0] for description in cursor.description]
-            
-            # 转换为字典格式
-            export_data = []
-            for record in all_records:
-                record_dict = dict(zip(column_names, record))
-                export_data.append(record_dict)
-            
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"✅ 数据已导出到: {filename}")
-            print(f"📊 导出记录数: {len(export_data)}")
+        all_records = self._fetch_all(
+            'SELECT * FROM todo_unified ORDER BY task_uuid, version',
+            key=lambda row: (row[1], row[2]),
+        )
+        
+        # 获取列名
+        with self._connect() as conn:
+            column_names = [column[1] for column in conn.execute('PRAGMA table_info(todo_unified)')]
+        
+        # 转换为字典格式
+        export_data = []
+        for record in all_records:
+            record_dict = dict(zip(column_names, record))
+            export_data.append(record_dict)
+        
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(export_data, f, ensure_ascii=False, indent=2)
+        
+        print(f"✅ 数据已导出到: {filename}")
+        print(f"📊 导出记录数: {len(export_data)}")
     
     def import_data(self, filename: str):
         """导入数据"""
@@ -752,165 +1870,944 @@ class TodoManager:
             return
         
         # 获取数据库列名
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('PRAGMA table_info(todo_unified)')
             db_columns = [column[1] for column in cursor.fetchall()]
-            
-            imported_count = 0
-            skipped_count = 0
-            
-            for record in import_data:
-                try:
-                    # 检查必要字段
-                    if 'task_uuid' not in record or 'version' not in record or 'task' not in record:
-                        print(f"⚠️ 跳过不完整记录: {record}")
-                        skipped_count += 1
-                        continue
-                    
-                    # 构建插入数据
-                    insert_data = []
-                    for col in db_columns:
-                        if col in record:
-                            insert_data.append(record[col])
-                        else:
-                            insert_data.append(None)
-                    
-                    # 插入记录
-                    placeholders = ','.join(['?' for _ in db_columns])
-                    cursor.execute(f'''
-                        INSERT INTO todo_unified ({','.join(db_columns)})
-                        VALUES ({placeholders})
-                    ''', insert_data)
-                    
-                    imported_count += 1
-                    
-                except Exception as e:
-                    print(f"⚠️ 跳过记录 (错误: {e}): {record}")
-                    skipped_count += 1
-            
-            conn.commit()
-            
-            print(f"✅ 数据导入完成!")
-            print(f"📊 成功导入: {imported_count} 条记录")
-            if skipped_count > 0:
-                print(f"⚠️ 跳过: {skipped_count} 条记录")
-            print(f"📁 导入文件: {filename}")
-
-def main():
-    """主函数"""
-    if len(sys.argv) < 2:
-        print("❌ 请提供命令参数")
-        print("💡 使用 'help' 命令查看可用选项")
-        return
-    
-    manager = TodoManager()
-    command = sys.argv[1].lower()
-    
-    try:
-        if command == "help":
-            manager.show_help()
-        
-        elif command == "version":
-            manager.show_version()
-        
-        elif command == "clear":
-            manager.clear_screen()
-        
-        elif command == "list":
-            status_filter = sys.argv[2] if len(sys.argv) > 2 else None
-            manager.list_tasks(status_filter)
-        
-        elif command == "show":
-            if len(sys.argv) < 3:
-                print("❌ 请提供任务UUID")
-                return
-            manager.show_task(sys.argv[2])
-        
-        elif command == "create":
-            if len(sys.argv) < 3:
-                print("❌ 请提供任务名称")
-                return
-            task_name = sys.argv[2]
-            priority = sys.argv[3] if len(sys.argv) > 3 else "medium"
-            manager.create_task(task_name, priority)
         
-        elif command == "update":
-            if len(sys.argv) < 4:
-                print("❌ 请提供UUID、字段名和值")
-                return
-            manager.update_task(sys.argv[2], sys.argv[3], sys.argv[4])
+        imported_count = 0
+        skipped_count = 0
         
-        elif command == "status":
-            if len(sys.argv) < 4:
-                print("❌ 请提供UUID和新状态")
-                return
-            manager.update_status(sys.argv[2], sys.argv[3])
-        
-        elif command == "delete":
-            if len(sys.argv) < 3:
-                print("❌ 请提供任务UUID")
-                return
-            manager.delete_task(sys.argv[2])
+        # 按分片分组, 每个分片一个事务
+        records_by_shard: Dict[str, List[Dict[str, Any]]] = {}
+        for record in import_data:
+            # 检查必要字段
+            if 'task_uuid' not in record or 'version' not in record or 'task' not in record:
+                print(f"⚠️ 跳过不完整记录: {record}")
+                skipped_count += 1
+                continue
+            records_by_shard.setdefault(self._shard_path(str(record['task_uuid'])), []).append(record)
         
-        elif command == "restore":
-            if len(sys.argv) < 3:
-                print("❌ 请提供任务UUID")
-                return
-            manager.restore_task(sys.argv[2])
+        for db_path, records in records_by_shard.items():
+            with self._connect(db_path=db_path) as conn:
+                cursor = conn.cursor()
+                
+                for record in records:
+                    try:
+                        # 构建插入数据
+                        insert_data = []
+                        for col in db_columns:
+                            if col in record:
+                                insert_data.append(record[col])
+                            else:
+                                insert_data.append(None)
+                        
+                        # 插入记录
+                        placeholders = ','.join(['?' for _ in db_columns])
+                        cursor.execute(f'''
+                            INSERT INTO todo_unified ({','.join(db_columns)})
+                            VALUES ({placeholders})
+                        ''', insert_data)
+                        
+                        imported_count += 1
+                        
+                    except Exception as e:
+                        print(f"⚠️ 跳过记录 (错误: {e}): {record}")
+                        skipped_count += 1
+                
+                conn.commit()
         
-        elif command == "clear_completed":
-            manager.clear_completed_tasks()
+        print(f"✅ 数据导入完成!")
+        print(f"📊 成功导入: {imported_count} 条记录")
+        if skipped_count > 0:
+            print(f"⚠️ 跳过: {skipped_count} 条记录")
+        print(f"📁 导入文件: {filename}")
+    
+    def backup(self, dest: str, pages_per_step: int = 1024, sleep: float = 0.01, vacuum: bool = False):
+        """用 SQLite 在线备份 API 把数据库 (所有分片) 复制到 dest
+
+        每复制 pages_per_step 页释放一次读锁, 其他连接的写入不会被整个备份
+        过程阻塞; 源库正被写入锁定时等待 sleep 秒后重试。先写入临时文件再
+        原子替换。vacuum=True 时
+        备份完成后用 VACUUM INTO 生成去除空闲页的紧凑副本
+        """
+        if pages_per_step < 1:
+            raise ValueError(f"每步页数必须大于0: {pages_per_step}")
+        dest_paths = shard_paths_for(dest, len(self.shard_paths))
+        for source_path, dest_path in zip(self.shard_paths, dest_paths):
+            if os.path.abspath(source_path) == os.path.abspath(dest_path):
+                raise ValueError(f"备份文件不能与数据库相同: {dest_path}")
         
-        elif command == "filter_by_status":
-            if len(sys.argv) < 3:
-                print("❌ 请提供状态 (todo/in_progress/completed)")
-                return
-            manager.filter_by_status(sys.argv[2])
+        for source_path, dest_path in zip(self.shard_paths, dest_paths):
+            started = time.perf_counter()
+            tmp_path = dest_path + '.tmp'
+            vacuum_path = dest_path + '.vacuum.tmp'
+            for path in (tmp_path, tmp_path + '-journal', vacuum_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            
+            progress = [0]
+            source = self._connect(db_path=source_path)
+            target = self._connect(db_path=tmp_path, snapshot=False)
+            try:
+                source.backup(target, pages=pages_per_step, sleep=sleep,
+                              progress=lambda status, remaining, total: progress.__setitem__(0, total))
+                # 备份文件不依赖 -wal/-shm, 便于以 immutable=1 打开
+                target.execute('PRAGMA journal_mode = DELETE')
+            finally:
+                target.close()
+                source.close()
+            
+            if vacuum:
+                conn = self._connect(db_path=tmp_path, snapshot=False)
+                conn.execute('VACUUM INTO ?', (vacuum_path,))
+                conn.close()
+                os.remove(tmp_path)
+                tmp_path = vacuum_path
+            os.replace(tmp_path, dest_path)
+            print(f"💾 {source_path} → {dest_path}: {progress[0]} 页, "
+                  f"{os.path.getsize(dest_path)} 字节, 耗时 {time.perf_counter() - started:.2f}s")
         
-        elif command == "filter_by_priority":
-            if len(sys.argv) < 3:
-                print("❌ 请提供优先级 (low/medium/high)")
-                return
-            manager.filter_by_priority(sys.argv[2])
+        shards_option = f" --shards {len(self.shard_paths)}" if len(self.shard_paths) > 1 else ""
+        print(f"💡 只读查询备份: python3 todo_manager.py --snapshot {dest}{shards_option} stats")
+    
+    def iter_changes(self, since_id: int = 0, cursor: Optional[Dict[int, int]] = None,
+                     batch_size: int = 500):
+        """按 id 顺序迭代新增的版本行 (字典格式与 export 相同)
+
+        cursor 记录每个分片已读到的最大 id, 迭代过程中原地更新, 调用方保存后
+        即可从断点继续; 未提供时所有分片都从 since_id 之后开始读取
+        """
+        if cursor is None:
+            cursor = {}
+        for index, db_path in enumerate(self.shard_paths):
+            cursor.setdefault(index, since_id)
+            with self._connect(db_path=db_path) as conn:
+                while True:
+                    rows = self._rows_after(conn, cursor[index], batch_size)
+                    columns = [description[0] for description in rows.description]
+                    batch = rows.fetchall()
+                    if not batch:
+                        break
+                    for row in batch:
+                        yield dict(zip(columns, row))
+                        cursor[index] = row[0]
+    
+    # 增量存储一次按 task_uuid 列表查询的最大行数 (受 SQLite 参数个数限制)
+    DELTA_ROWS_BATCH = 10000
+    
+    def _rows_after(self, conn: sqlite3.Connection, last_id: int, limit: int) -> sqlite3.Cursor:
+        """按 id 顺序查询 id 大于 last_id 的一批版本行 (行数可能少于 limit, 读到空结果为止)
+
+        增量存储的视图按 task_uuid 分区计算窗口函数, id 条件无法下推, 会为每批
+        重建整张表; 因此先在 todo_delta 上按 id 找出这批行所属的任务, 再用可以
+        下推到分区的 task_uuid 列表查询视图
+        """
+        if not self.delta:
+            return conn.execute('SELECT * FROM todo_unified WHERE id > ? ORDER BY id LIMIT ?', (last_id, limit))
+        limit = min(limit, self.DELTA_ROWS_BATCH)
+        task_uuids = [row[0] for row in conn.execute(
+            'SELECT DISTINCT task_uuid FROM (SELECT task_uuid FROM todo_delta WHERE id > ? ORDER BY id LIMIT ?)',
+            (last_id, limit))]
+        return conn.execute(f'''
+            SELECT * FROM todo_unified 
+            WHERE task_uuid IN ({','.join('?' for _ in task_uuids)}) AND id > ?
+            ORDER BY id LIMIT ?
+        ''', task_uuids + [last_id, limit])
+    
+    @staticmethod
+    def _load_change_cursor(cursor_file: Optional[str]) -> Dict[int, int]:
+        """读取各分片的读取位置; 文件中没有的分片由 iter_changes 从 since_id 开始"""
+        if cursor_file and os.path.exists(cursor_file):
+            with open(cursor_file, 'r', encoding='utf-8') as f:
+                return {int(index): last_id for index, last_id in json.load(f).items()}
+        return {}
+    
+    @staticmethod
+    def _save_change_cursor(cursor_file: str, cursor: Dict[int, int]):
+        tmp_path = cursor_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(index): last_id for index, last_id in cursor.items()}, f)
+        os.replace(tmp_path, cursor_file)
+    
+    def watch_changes(self, since_id: int = 0, cursor_file: Optional[str] = None,
+                      interval: float = 0.5, once: bool = False, out=None):
+        """以 JSON Lines 格式持续输出新的版本行
+
+        轮询各分片的 PRAGMA data_version (不读表), 只有其他连接提交了写入
+        才查询新行; cursor_file 保存每个分片的读取位置, 重启后从断点继续
+        """
+        out = out or sys.stdout
+        cursor = self._load_change_cursor(cursor_file)
+        watchers = [sqlite3.connect(db_path) for db_path in self.shard_paths]
+        seen_versions = None
+        try:
+            while True:
+                versions = [conn.execute('PRAGMA data_version').fetchone()[0] for conn in watchers]
+                if versions != seen_versions:
+                    seen_versions = versions
+                    for row in self.iter_changes(since_id, cursor):
+                        out.write(json.dumps(row, ensure_ascii=False) + '\n')
+                    out.flush()
+                    if cursor_file:
+                        self._save_change_cursor(cursor_file, cursor)
+                if once:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for conn in watchers:
+                conn.close()
+            if cursor_file:
+                self._save_change_cursor(cursor_file, cursor)
+    
+    def _prepare_follower(self, follower_path: str):
+        """创建从库表结构和复制进度表 (不改变主库的存储格式设置)"""
+        storage = self.compact, self.delta
+        self._init_shard(follower_path, 0)
+        self.compact, self.delta = storage
+        with self._connect(db_path=follower_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS todo_replication (
+                    source TEXT PRIMARY KEY,
+                    last_id INTEGER NOT NULL DEFAULT 0,
+                    last_change INTEGER NOT NULL DEFAULT 0,
+                    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(todo_replication)')}
+            if 'last_change' not in columns:
+                conn.execute('ALTER TABLE todo_replication ADD COLUMN last_change INTEGER NOT NULL DEFAULT 0')
+    
+    @staticmethod
+    def _save_progress(follower: sqlite3.Connection, source: str, state: list):
+        follower.execute('''
+            INSERT INTO todo_replication (source, last_id, last_change, synced_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (source) DO UPDATE SET
+                last_id = excluded.last_id,
+                last_change = excluded.last_change,
+                synced_at = excluded.synced_at
+        ''', (source, state[0], state[1]))
+    
+    def _apply_to_follower(self, rows, follower, source: str, state: list, batch_size: int) -> int:
+        """把主库游标中的新行分批写入从库, 每批与复制进度在同一事务中提交"""
+        columns = [description[0] for description in rows.description]
+        insert_sql = (f"INSERT OR REPLACE INTO todo_unified ({','.join(columns)}) "
+                      f"VALUES ({','.join('?' for _ in columns)})")
+        applied = 0
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                return applied
+            state[0] = max(state[0], max(row[0] for row in batch))
+            with follower:
+                follower.executemany(insert_sql, batch)
+                self._save_progress(follower, source, state)
+            applied += len(batch)
+    
+    def _apply_changed_tasks(self, primary, follower, source: str, state: list, batch_size: int) -> int:
+        """把修改日志中序号大于 state[1] 的任务在从库上整体替换为主库的版本行 (id <= state[0])
+
+        原地更新和删除 (如 fsck 修复) 都会记录到修改日志, 因此从库会删除主库已删除的行
+        """
+        changed = primary.execute(
+            'SELECT task_uuid, seq FROM todo_changes WHERE seq > ? ORDER BY seq', (state[1],)
+        ).fetchall()
+        if state[0] == 0:
+            # 从库还没有任何行, 新行复制会带上这些任务的当前内容
+            changed, state[1] = [], max([state[1]] + [seq for _, seq in changed])
+        follower_compact = follower.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'todo_compact'").fetchone() is not None
+        follower_filter = ('id IN (SELECT id FROM todo_compact WHERE task_uuid = todo_uuid_blob(?))'
+                           if follower_compact else 'task_uuid = ?')
+        applied = 0
+        for start in range(0, len(changed), batch_size):
+            with follower:
+                for task_uuid, seq in changed[start:start + batch_size]:
+                    rows = primary.execute(
+                        f'SELECT * FROM todo_unified WHERE {self._task_filter()} AND id <= ? ORDER BY id',
+                        (task_uuid, state[0]),
+                    )
+                    columns = [description[0] for description in rows.description]
+                    batch = rows.fetchall()
+                    follower.execute(f'DELETE FROM todo_unified WHERE {follower_filter} AND id <= ?',
+                                     (task_uuid, state[0]))
+                    follower.executemany(
+                        f"INSERT INTO todo_unified ({','.join(columns)}) VALUES ({','.join('?' for _ in columns)})",
+                        batch)
+                    applied += len(batch)
+                    state[1] = seq
+                self._save_progress(follower, source, state)
+        return applied
+    
+    def _replicate_shard(self, source_path: str, follower_path: str, batch_size: int) -> int:
+        """把一个主库分片的新行和修改过的任务同步到从库, 返回写入的行数"""
+        source = os.path.abspath(source_path)
+        follower = self._connect(db_path=follower_path)
+        primary = self._connect(db_path=source_path)
+        try:
+            row = follower.execute(
+                'SELECT last_id, last_change FROM todo_replication WHERE source = ?', (source,)
+            ).fetchone()
+            state = list(row) if row else [0, 0]
+            
+            # 在同一个读事务 (快照) 中读取修改日志和新行, 之后提交的修改序号一定大于已同步的序号
+            primary.isolation_level = None
+            primary.execute('BEGIN')
+            try:
+                applied = self._apply_changed_tasks(primary, follower, source, state, batch_size)
+                while True:
+                    copied = self._apply_to_follower(self._rows_after(primary, state[0], batch_size),
+                                                     follower, source, state, batch_size)
+                    if not copied:
+                        break
+                    applied += copied
+                if row is None or state[1] != row[1]:
+                    with follower:
+                        self._save_progress(follower, source, state)
+            finally:
+                primary.execute('COMMIT')
+            return applied
+        finally:
+            primary.close()
+            follower.close()
+    
+    def replicate(self, followers: List[str], batch_size: int = 1000, follow: bool = False,
+                  interval: float = 1.0):
+        """按 id 把 todo_unified 的新行分批复制到一个或多个只读从库
+
+        所有分片复制到同一个从库文件; 首次复制时在主库创建修改日志 (见
+        _change_log_schema), 之后的原地更新和删除按任务重放到从库。
+        follow=True 时持续运行, 仅在主库 PRAGMA data_version 变化时才同步
+        """
+        for db_path in self.shard_paths:
+            with self._connect(db_path=db_path) as conn:
+                for statement in _change_log_schema(self.storage_table):
+                    conn.execute(statement)
+        for follower_path in followers:
+            self._prepare_follower(follower_path)
         
-        elif command == "overdue":
-            manager.show_overdue_tasks()
+        watchers = [sqlite3.connect(db_path) for db_path in self.shard_paths]
+        seen_versions = None
+        try:
+            while True:
+                versions = [conn.execute('PRAGMA data_version').fetchone()[0] for conn in watchers]
+                if versions != seen_versions:
+                    seen_versions = versions
+                    for follower_path in followers:
+                        applied = sum(self._replicate_shard(db_path, follower_path, batch_size)
+                                      for db_path in self.shard_paths)
+                        if applied or not follow:
+                            print(f"🔁 {follower_path}: 同步 {applied} 条记录")
+                if not follow:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for conn in watchers:
+                conn.close()
+    
+    def show_replication_lag(self, followers: List[str]):
+        """显示各从库相对主库的复制延迟"""
+        print(f"{'从库':<30} {'主库分片':<30} {'落后行数':<10} {'延迟(秒)':<10} {'最近同步':<20}")
+        print("─" * 105)
+        for follower_path in followers:
+            with self._connect(db_path=follower_path) as follower:
+                progress = dict((source, (last_id, synced_at)) for source, last_id, synced_at in follower.execute(
+                    'SELECT source, last_id, synced_at FROM todo_replication'))
+            for db_path in self.shard_paths:
+                last_id, synced_at = progress.get(os.path.abspath(db_path), (0, None))
+                with self._connect(db_path=db_path) as conn:
+                    behind, lag_seconds = conn.execute('''
+                        SELECT COUNT(*), (julianday('now') - julianday(MIN(created_at))) * 86400
+                        FROM todo_unified WHERE id > ?
+                    ''', (last_id,)).fetchone()
+                print(f"{follower_path:<30} {os.path.basename(db_path):<30} {behind:<10} "
+                      f"{(lag_seconds or 0):<10.1f} {synced_at or '从未同步'}")
+    
+    @staticmethod
+    def _chunk_digests(conn: sqlite3.Connection, digests: Dict[int, List[int]]):
+        """按 id 分段 (每段 65536 个 id) 计算行数和与顺序无关的校验和"""
+        for row in conn.execute('SELECT * FROM todo_unified'):
+            chunk = digests.setdefault(row[0] >> 16, [0, 0])
+            chunk[0] += 1
+            chunk[1] = (chunk[1] + zlib.crc32(repr(row).encode('utf-8'))) & 0xFFFFFFFFFFFFFFFF
+    
+    def check_replica(self, follower_path: str) -> Dict[str, Any]:
+        """比较主库 (所有分片) 与从库的内容, 返回不一致的 id 区间"""
+        primary: Dict[int, List[int]] = {}
+        for db_path in self.shard_paths:
+            with self._connect(db_path=db_path) as conn:
+                self._chunk_digests(conn, primary)
+        replica: Dict[int, List[int]] = {}
+        with self._connect(db_path=follower_path) as conn:
+            self._chunk_digests(conn, replica)
         
-        elif command == "history":
-            if len(sys.argv) < 3:
-                print("❌ 请提供任务UUID")
-                return
-            manager.show_history(sys.argv[2])
+        mismatched = sorted(chunk for chunk in set(primary) | set(replica)
+                            if primary.get(chunk) != replica.get(chunk))
+        report = {
+            'follower': follower_path,
+            'primary_rows': sum(count for count, _ in primary.values()),
+            'follower_rows': sum(count for count, _ in replica.values()),
+            'mismatched_id_ranges': [[chunk << 16, ((chunk + 1) << 16) - 1] for chunk in mismatched],
+        }
         
-        elif command == "search":
-            if len(sys.argv) < 3:
-                print("❌ 请提供搜索关键词")
-                return
-            manager.search_tasks(sys.argv[2])
+        if not mismatched:
+            print(f"✅ {follower_path} 与主库一致 ({report['primary_rows']} 条记录)")
+        else:
+            print(f"❌ {follower_path} 与主库不一致: 主库 {report['primary_rows']} 条, 从库 {report['follower_rows']} 条")
+            for start, end in report['mismatched_id_ranges']:
+                print(f"  ⚠️ id 区间 {start}-{end} 不一致")
+        return report
+
+    def _fsck_ranges(self) -> List[Tuple[str, str, tuple]]:
+        """把 task_uuid 空间划分为区间, 返回每个区间的 (检查SQL, 计数SQL, 参数)
+
+        紧凑存储按 todo_compact 中原始的 BLOB 比较 (自定义文本ID均小于BLOB,
+        落在第一个区间), 其他存储按UUID文本比较
+        """
+        bounds = [bytes([b]) if self.compact else f'{b:02x}' for b in FSCK_RANGE_BOUNDS]
+        ranges = []
+        for low, high in zip([None] + bounds, bounds + [None]):
+            conditions = []
+            params = []
+            if low is not None:
+                conditions.append('task_uuid >= ?')
+                params.append(low)
+            if high is not None:
+                conditions.append('task_uuid < ?')
+                params.append(high)
+            range_filter = ' AND '.join(conditions)
+            if self.compact:
+                view_filter = f"id IN (SELECT id FROM todo_compact WHERE {range_filter})"
+            else:
+                view_filter = range_filter
+            check_sql = f'''
+                SELECT id, task_uuid, version, operation_type, prev_version, prev_operation, position,
+                       task IS NULL, status IS NULL, priority IS NULL
+                FROM (
+                    SELECT 
+                        id, task_uuid, version, task, status, priority, operation_type,
+                        LAG(version) OVER history as prev_version,
+                        LAG(operation_type) OVER history as prev_operation,
+                        ROW_NUMBER() OVER history as position
+                    FROM todo_unified
+                    WHERE {view_filter}
+                    WINDOW history AS (PARTITION BY task_uuid ORDER BY version, id)
+                )
+                WHERE version IS NULL OR task IS NULL OR status IS NULL OR priority IS NULL
+                    OR operation_type IS NULL
+                    OR version = prev_version
+                    OR version > prev_version + 1
+                    OR (position = 1 AND (version != 1 OR operation_type != 'create'))
+                    OR (operation_type = 'restore' AND prev_operation IS NOT 'delete')
+            '''
+            count_sql = f"SELECT COUNT(*), COUNT(DISTINCT task_uuid) FROM {self.storage_table} WHERE {range_filter}"
+            ranges.append((check_sql, count_sql, tuple(params)))
+        return ranges
+    
+    @staticmethod
+    def _classify_problem(row) -> List[Dict[str, Any]]:
+        """把检查SQL返回的一行转换为问题列表"""
+        row_id, task_uuid, version, operation_type, prev_version, prev_operation, position = row[:7]
+        base = {'task_uuid': task_uuid, 'id': row_id, 'version': version}
+        problems = []
+        null_columns = [column for column, is_null in
+                        zip(('version', 'task', 'status', 'priority', 'operation_type'),
+                            (version is None,) + tuple(row[7:]) + (operation_type is None,)) if is_null]
+        if null_columns:
+            problems.append(dict(base, issue='null_fields', columns=null_columns))
+        if version is not None and version == prev_version:
+            problems.append(dict(base, issue='duplicate_version'))
+        if version is not None and (position == 1 and version != 1
+                                    or prev_version is not None and version > prev_version + 1):
+            problems.append(dict(base, issue='version_gap', previous_version=prev_version))
+        if position == 1 and operation_type != 'create':
+            problems.append(dict(base, issue='missing_create', operation_type=operation_type))
+        if operation_type == 'restore' and prev_operation != 'delete':
+            problems.append(dict(base, issue='orphan_restore', previous_operation=prev_operation))
+        return problems
+    
+    def check_integrity(self, workers: Optional[int] = None) -> Dict[str, Any]:
+        """并行检查所有分片的版本日志, 返回报告字典
+
+        每个分片按 task_uuid 划分为多个区间, 由进程池在只读连接上用窗口函数
+        检查: 重复版本、版本号缺口、首个版本不是 create、restore 之前没有
+        delete, 以及 NULL 字段
+        """
+        started = time.perf_counter()
+        jobs = [(db_path,) + job for db_path in self.shard_paths for job in self._fsck_ranges()]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            results = list(pool.map(_fsck_range, *zip(*jobs)))
         
-        elif command == "stats":
-            manager.show_stats()
+        problems = []
+        for (db_path, *_), (_, _, rows) in zip(jobs, results):
+            for row in rows:
+                problems.extend(dict(problem, shard=db_path) if len(self.shard_paths) > 1 else problem
+                                for problem in self._classify_problem(row))
+        problems.sort(key=lambda problem: (str(problem['task_uuid']), problem['version'] or 0, problem['id']))
         
-        elif command == "export":
-            if len(sys.argv) < 3:
-                print("❌ 请提供文件名")
-                return
-            manager.export_data(sys.argv[2])
+        issues: Dict[str, int] = {}
+        for problem in problems:
+            issues[problem['issue']] = issues.get(problem['issue'], 0) + 1
+        issues = dict(sorted(issues.items()))
+        return {
+            'database': self.db_path,
+            'shards': len(self.shard_paths),
+            'rows_checked': sum(rows for rows, _, _ in results),
+            'tasks_checked': sum(tasks for _, tasks, _ in results),
+            'tasks_with_problems': len({problem['task_uuid'] for problem in problems}),
+            'issues': issues,
+            'problems': problems,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+    
+    @staticmethod
+    def _repair_history(rows: List[tuple]) -> List[tuple]:
+        """修复一个任务按 (version, id) 排序的全部版本行, 返回修复后的行
+
+        删除与前一行内容完全相同的重复版本, 版本号重新编号为 1..N, 首个版本
+        标记为 create, 没有前置 delete 的 restore 改为 update, NULL 字段
+        从前一版本继承 (没有前一版本时使用表的默认值)
+        """
+        fixed: List[list] = []
+        previous = None
+        for row in rows:
+            if previous is not None and row[2] == previous[2] and row[3:9] == previous[3:9]:
+                continue
+            previous = row
+            row_id, task_uuid, _, task, status, priority, due_date, operation_type, change_summary = row[:9]
+            last = fixed[-1] if fixed else None
+            if not fixed:
+                operation_type = 'create'
+            elif operation_type is None:
+                operation_type = 'update'
+            elif operation_type == 'restore' and last[7] != 'delete':
+                operation_type = 'update'
+            fixed.append([
+                row_id, task_uuid, len(fixed) + 1,
+                task if task is not None else (last[3] if last else change_summary or ''),
+                status if status is not None else (last[4] if last else 'todo'),
+                priority if priority is not None else (last[5] if last else 'medium'),
+                due_date, operation_type, change_summary, row[9],
+            ])
+        return [tuple(row) for row in fixed]
+    
+    def _repair_tasks(self, db_path: str, task_uuids: List[str], batch_size: int) -> Dict[str, int]:
+        """按批重写有问题任务的版本历史, 每批一个事务
+
+        重写通过先删除再插入完成; 开启复制后删除会记录到修改日志 (见
+        _change_log_schema), 从库下次同步时整体替换这些任务, 包括删掉重复版本
+        """
+        repaired = {'tasks': 0, 'rows_rewritten': 0, 'rows_removed': 0}
+        with self._connect(db_path=db_path) as conn:
+            # 读取和重写必须在同一个写锁下: Python 默认到 DELETE 才开启事务,
+            # 期间其他连接提交的新版本会被删除并以旧内容重写
+            conn.isolation_level = None
+            cursor = conn.cursor()
+            for start in range(0, len(task_uuids), batch_size):
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    for task_uuid in task_uuids[start:start + batch_size]:
+                        cursor.execute(f'''
+                            SELECT id, task_uuid, version, task, status, priority, due_date,
+                                   operation_type, change_summary, created_at
+                            FROM todo_unified 
+                            WHERE {self._task_filter()}
+                            ORDER BY version IS NULL, version, id
+                        ''', (task_uuid,))
+                        rows = cursor.fetchall()
+                        fixed = self._repair_history(rows)
+                        if fixed == [row[:10] for row in rows]:
+                            continue
+                        cursor.execute(f'DELETE FROM todo_unified WHERE {self._task_filter()}', (task_uuid,))
+                        cursor.executemany('''
+                            INSERT INTO todo_unified (
+                                id, task_uuid, version, task, status, priority, due_date,
+                                operation_type, change_summary, created_at, updated_at
+                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        ''', fixed)
+                        repaired['tasks'] += 1
+                        repaired['rows_rewritten'] += len(fixed)
+                        repaired['rows_removed'] += len(rows) - len(fixed)
+                    cursor.execute('COMMIT')
+                except BaseException:
+                    if conn.in_transaction:
+                        cursor.execute('ROLLBACK')
+                    raise
+        return repaired
+    
+    def fsck(self, repair: bool = False, workers: Optional[int] = None, batch_size: int = 500,
+             report_file: Optional[str] = None) -> Dict[str, Any]:
+        """检查版本日志的完整性并输出JSON报告; repair=True 时修复有问题的任务后重新检查"""
+        report = self.check_integrity(workers)
+        if repair and report['problems']:
+            tasks_by_shard: Dict[str, List[str]] = {}
+            for problem in report['problems']:
+                tasks = tasks_by_shard.setdefault(self._shard_path(str(problem['task_uuid'])), [])
+                if not tasks or tasks[-1] != problem['task_uuid']:
+                    tasks.append(problem['task_uuid'])
+            repaired = {'tasks': 0, 'rows_rewritten': 0, 'rows_removed': 0}
+            for db_path, task_uuids in tasks_by_shard.items():
+                for key, value in self._repair_tasks(db_path, task_uuids, batch_size).items():
+                    repaired[key] += value
+            after = self.check_integrity(workers)
+            report['repaired'] = repaired
+            report['after_repair'] = {'issues': after['issues'], 'problems': after['problems']}
         
-        elif command == "import":
-            if len(sys.argv) < 3:
-                print("❌ 请提供文件名")
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if report_file is None:
+            print(text)
+        else:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+            remaining = report.get('after_repair', report)['issues']
+            print(f"{'✅' if not remaining else '⚠️'} 检查 {report['rows_checked']} 条记录, "
+                  f"发现 {len(report['problems'])} 个问题, 报告已写入: {report_file}")
+        return report
+
+def _best_of(func, repeat_count: int = 3) -> float:
+    """多次运行取最短耗时 (毫秒)"""
+    best = float('inf')
+    for _ in range(repeat_count):
+        started = time.perf_counter()
+        func()
+        best = min(best, (time.perf_counter() - started) * 1000)
+    return best
+
+
+def run_storage_benchmark(rows: int = 100000, lookups: int = 1000):
+    """用相同的合成数据比较文本存储和紧凑存储的文件大小与查询速度"""
+    import random
+    import tempfile
+    
+    rng = random.Random(42)
+    versions_per_task = 4
+    task_uuids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(max(rows // versions_per_task, 1))]
+    records = []
+    for task_uuid in task_uuids:
+        for version in range(1, versions_per_task + 1):
+            records.append((
+                task_uuid, version, f"任务 {task_uuid[:8]}",
+                rng.choice(STATUS_VALUES), rng.choice(PRIORITY_VALUES), None,
+                'create' if version == 1 else rng.choice(('update', 'status_change')),
+                f"version {version}",
+            ))
+    sample = [rng.choice(task_uuids) for _ in range(lookups)]
+    
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, compact in (('text', False), ('compact', True)):
+            db_path = os.path.join(tmp_dir, f'{name}.db')
+            manager = TodoManager(db_path, compact=compact)
+            with manager._connect() as conn:
+                conn.executemany('''
+                    INSERT INTO todo_unified (
+                        task_uuid, version, task, status, priority, due_date, operation_type, change_summary
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', records)
+            conn = manager._connect()
+            conn.execute('VACUUM')
+            
+            scan_sql = f'''
+                SELECT u.status, COUNT(DISTINCT u.task_uuid)
+                FROM todo_unified u
+                {manager._latest_join()}
+                WHERE u.operation_type != 'delete'
+                GROUP BY u.status
+            '''
+            lookup_sql = f"SELECT * FROM todo_unified WHERE {manager._task_filter()} ORDER BY version"
+            results[name] = {
+                'size': os.path.getsize(db_path),
+                'full_scan_ms': _best_of(lambda: conn.execute('SELECT * FROM todo_unified').fetchall()),
+                'stats_ms': _best_of(lambda: conn.execute(scan_sql).fetchall()),
+                'lookup_ms': _best_of(lambda: [conn.execute(lookup_sql, (task_uuid,)).fetchall()
+                                               for task_uuid in sample]),
+            }
+            conn.close()
+    
+    print(f"📏 存储格式基准测试: {len(records)} 条版本记录, {len(task_uuids)} 个任务")
+    print(f"{'指标':<28} {'文本存储':>14} {'紧凑存储':>14} {'变化':>10}")
+    print("─" * 72)
+    for key, label in (('size', '文件大小 (字节)'), ('full_scan_ms', '全表读取 (ms)'),
+                       ('stats_ms', '最新版本统计 (ms)'), ('lookup_ms', f'{lookups} 次按UUID查询 (ms)')):
+        text_value, compact_value = results['text'][key], results['compact'][key]
+        change = (compact_value - text_value) / text_value * 100 if text_value else 0.0
+        fmt = ",.0f" if key == "size" else ".1f"
+        print(f"{label:<28} {text_value:>14{fmt}} {compact_value:>14{fmt}} {change:>+9.1f}%")
+
+
+def dispatch_command(manager: TodoManager, command: str, args: List[str], fmt: str = 'table'):
+    """执行单个命令; 未知命令返回 False
+
+    fmt 为只读命令 (list/show/filter_*/overdue/history/search/stats) 的输出格式
+    """
+    if command == "help":
+        manager.show_help()
+    
+    elif command == "version":
+        manager.show_version()
+    
+    elif command == "clear":
+        manager.clear_screen()
+    
+    elif command == "list":
+        status_filter = args[2] if len(args) > 2 else None
+        manager.list_tasks(status_filter, fmt)
+    
+    elif command == "show":
+        if len(args) < 3:
+            print_notice("❌ 请提供任务UUID", fmt)
+            return
+        manager.show_task(args[2], fmt)
+    
+    elif command == "create":
+        if len(args) < 3:
+            print("❌ 请提供任务名称")
+            return
+        task_name = args[2]
+        priority = args[3] if len(args) > 3 else "medium"
+        manager.create_task(task_name, priority)
+    
+    elif command == "update":
+        if len(args) > 3 and args[3].startswith('--'):
+            changes, rest = parse_options(args[3:], {}, UPDATE_OPTIONS)
+            if rest:
+                print(f"❌ 无法识别的参数: {' '.join(rest)}")
                 return
-            manager.import_data(sys.argv[2])
-        
+            manager.update_fields(args[2], changes)
+            return
+        if len(args) < 5:
+            print("❌ 请提供UUID、字段名和值")
+            return
+        manager.update_task(args[2], args[3], args[4])
+    
+    elif command == "status":
+        if len(args) < 4:
+            print("❌ 请提供UUID和新状态")
+            return
+        manager.update_status(args[2], args[3])
+    
+    elif command == "delete":
+        if len(args) < 3:
+            print("❌ 请提供任务UUID")
+            return
+        manager.delete_task(args[2])
+    
+    elif command == "restore":
+        if len(args) < 3:
+            print("❌ 请提供任务UUID")
+            return
+        manager.restore_task(args[2])
+    
+    elif command == "clear_completed":
+        manager.clear_completed_tasks()
+    
+    elif command == "filter_by_status":
+        if len(args) < 3:
+            print_notice("❌ 请提供状态 (todo/in_progress/completed)", fmt)
+            return
+        manager.filter_by_status(args[2], fmt)
+    
+    elif command == "filter_by_priority":
+        if len(args) < 3:
+            print_notice("❌ 请提供优先级 (low/medium/high)", fmt)
+            return
+        manager.filter_by_priority(args[2], fmt)
+    
+    elif command == "overdue":
+        manager.show_overdue_tasks(fmt)
+    
+    elif command == "history":
+        if len(args) < 3:
+            print_notice("❌ 请提供任务UUID", fmt)
+            return
+        manager.show_history(args[2], fmt)
+    
+    elif command == "search":
+        if len(args) < 3:
+            print_notice("❌ 请提供搜索关键词", fmt)
+            return
+        manager.search_tasks(args[2], fmt)
+    
+    elif command == "stats":
+        manager.show_stats(fmt)
+    
+    elif command == "export":
+        if len(args) < 3:
+            print("❌ 请提供文件名")
+            return
+        manager.export_data(args[2])
+    
+    elif command == "import":
+        if len(args) < 3:
+            print("❌ 请提供文件名")
+            return
+        manager.import_data(args[2])
+    
+    elif command == "watch":
+        options, _ = parse_options(args[2:], {'--once': 'once'}, {
+            '--since': ('since_id', int),
+            '--cursor': ('cursor_file', str),
+            '--interval': ('interval', float),
+        })
+        manager.watch_changes(**options)
+    
+    elif command == "replicate":
+        options, followers = parse_options(args[2:], {
+            '--follow': 'follow', '--check': 'check', '--lag': 'lag',
+        }, {
+            '--batch': ('batch_size', int),
+            '--interval': ('interval', float),
+        })
+        if not followers:
+            print("❌ 请提供从库文件")
+            return
+        if options.pop('check', False):
+            for follower in followers:
+                manager.check_replica(follower)
+        elif options.pop('lag', False):
+            manager.show_replication_lag(followers)
         else:
-            print(f"❌ 未知命令: {command}")
-            print("💡 使用 'help' 命令查看可用选项")
+            manager.replicate(followers, **options)
+    
+    elif command == "backup":
+        options, rest = parse_options(args[2:], {'--vacuum': 'vacuum'}, {
+            '--pages': ('pages_per_step', int),
+            '--sleep': ('sleep', float),
+        })
+        if not rest:
+            print("❌ 请提供备份文件名")
+            return
+        manager.backup(rest[0], **options)
+    
+    elif command == "fsck":
+        options, _ = parse_options(args[2:], {'--repair': 'repair'}, {
+            '--workers': ('workers', int),
+            '--batch': ('batch_size', int),
+            '--report': ('report_file', str),
+        })
+        manager.fsck(**options)
+    
+    elif command == "migrate_compact":
+        manager.migrate_compact()
+    
+    elif command == "migrate_delta":
+        manager.migrate_delta()
     
+    elif command == "benchmark":
+        run_storage_benchmark(int(args[2]) if len(args) > 2 else 100000)
+    
+    elif command == "metrics":
+        manager.export_metrics(args[2] if len(args) > 2 else None)
+    
+    else:
+        print(f"❌ 未知命令: {command}")
+        print("💡 使用 'help' 命令查看可用选项")
+        return False
+
+
+def output_format(value: str) -> str:
+    """校验 --format 的取值"""
+    if value not in OUTPUT_FORMATS:
+        raise ValueError(value)
+    return value
+
+
+UPDATE_OPTIONS = {
+    '--task': ('task', str),
+    '--priority': ('priority', str),
+    '--due': ('due_date', str),
+    '--status': ('status', str),
+}
+
+GLOBAL_FLAGS = {'--profile': 'profile', '--compact': 'compact', '--delta': 'delta'}
+GLOBAL_OPTIONS = {
+    '--slow-ms': ('slow_query_ms', float),
+    '--db': ('db_path', str),
+    '--shards': ('shards', int),
+    '--format': ('fmt', output_format),
+    '--snapshot': ('snapshot', str),
+}
+
+
+def parse_options(tokens: List[str], flags: Dict[str, str], options: Dict[str, tuple]):
+    """取出 tokens 中的选项, 返回 (选项字典, 剩余参数)
+
+    flags 把开关映射到选项名; options 把带值选项映射到 (选项名, 类型转换函数)
+    """
+    values: Dict[str, Any] = {}
+    rest = []
+    i = 0
+    while i < len(tokens):
+        arg = tokens[i]
+        if arg in flags:
+            values[flags[arg]] = True
+        elif arg in options:
+            if i + 1 >= len(tokens):
+                raise ValueError(f"选项 {arg} 需要一个值")
+            name, convert = options[arg]
+            try:
+                values[name] = convert(tokens[i + 1])
+            except ValueError:
+                raise ValueError(f"选项 {arg} 的值无效: {tokens[i + 1]}")
+            i += 1
+        else:
+            rest.append(arg)
+        i += 1
+    return values, rest
+
+
+def parse_global_options(argv: List[str]):
+    """从命令行中取出全局选项, 返回 (选项字典, 剩余参数)"""
+    options, rest = parse_options(argv[1:], GLOBAL_FLAGS, GLOBAL_OPTIONS)
+    return options, [argv[0]] + rest
+
+
+def main():
+    """主函数"""
+    try:
+        options, args = parse_global_options(sys.argv)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+
+    if len(args) < 2:
+        print("❌ 请提供命令参数")
+        print("💡 使用 'help' 命令查看可用选项")
+        return
+
+    fmt = options.get('fmt', 'table')
+    try:
+        manager = TodoManager(
+            db_path=options.get('snapshot', options.get('db_path', DEFAULT_DB_PATH)),
+            snapshot='snapshot' in options,
+            shards=options.get('shards', 1),
+            compact=options.get('compact', False),
+            delta=options.get('delta', False),
+            profile=options.get('profile', False),
+            slow_query_ms=options.get('slow_query_ms', 100.0),
+        )
+    except (ValueError, sqlite3.Error) as e:
+        print_notice(f"❌ 无法打开数据库: {e}", fmt)
+        return
+    command = args[1].lower()
+
+    try:
+        manager.run_command(command, dispatch_command, manager, command, args, fmt)
     except Exception as e:
-        print(f"❌ 执行命令时出错: {e}")
-        print("💡 检查参数是否正确，使用 'help' 查看用法")
+        print_notice(f"❌ 执行命令时出错: {e}", fmt)
+        print_notice("💡 检查参数是否正确，使用 'help' 查看用法", fmt)
+
+    try:
+        manager.save_metrics()
+    except sqlite3.Error as e:
+        print_notice(f"⚠️ 保存指标失败: {e}", fmt)
+    manager.print_profile(fmt)
+    manager.close()
 
 if __name__ == "__main__":
     main()